@@ -0,0 +1,83 @@
+"""
+对比旧版全量 json.loads / json.dumps 与 trybot.event 编解码的耗时
+
+运行: python benchmarks/event_codec.py [recorded.jsonl]
+
+可传入录制的 go-cqhttp 数据帧(每行一个JSON), 否则使用按常见比例合成的数据
+"""
+
+import os
+import sys
+import json
+import time
+import random
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from trybot.event import Event, classify, is_heartbeat, decode, encode, FRAME_EVENT, FRAME_ECHO, FRAME_HEARTBEAT
+
+
+def synthesize(count: int = 20000) -> list:
+    frames = []
+    for i in range(count):
+        kind = random.random()
+        if kind < 0.3:
+            body = {'interval': 5000, 'meta_event_type': 'heartbeat', 'post_type': 'meta_event', 'self_id': 10001,
+                    'status': {'app_enabled': True, 'app_good': True, 'online': True, 'stat': {'packet_received': i}},
+                    'time': 1660000000 + i}
+        elif kind < 0.5:
+            body = {'data': {'message_id': i}, 'echo': i, 'retcode': 0, 'status': 'ok'}
+        else:
+            text = '群聊消息内容' * random.randint(1, 40)
+            body = {'anonymous': None, 'font': 0, 'group_id': 12345, 'message': text, 'message_id': i,
+                    'message_seq': i, 'message_type': 'group', 'post_type': 'message', 'raw_message': text,
+                    'self_id': 10001, 'sender': {'age': 0, 'area': '', 'card': '', 'level': '', 'nickname': '用户',
+                                                 'role': 'member', 'sex': 'unknown', 'title': '', 'user_id': 20002},
+                    'sub_type': 'normal', 'time': 1660000000 + i, 'user_id': 20002}
+        frames.append(json.dumps(body, ensure_ascii=False).encode())
+    return frames
+
+
+def legacy(frames: list) -> None:
+    for data in frames:
+        event = json.loads(data)
+        if 'echo' in event or 'meta_event_type' in event:
+            continue
+        json.dumps({'action': 'send_group_msg', 'params': {'group_id': event['group_id'], 'message': '收到'}, 'echo': 1}).encode()
+
+
+def current(frames: list) -> None:
+    for data in frames:     # 与 BotDriver.listen 相同的处理顺序
+        if is_heartbeat(data):
+            continue
+        event = decode(data)
+        if not isinstance(event, Event) or 'meta_event_type' in event:
+            continue
+        encode({'action': 'send_group_msg', 'params': {'group_id': event['group_id'], 'message': '收到'}, 'echo': 1})
+
+
+def main():
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], 'rb') as f:
+            frames = [line.strip() for line in f if line.strip()]
+    else:
+        frames = synthesize()
+
+    names = {FRAME_HEARTBEAT: 'heartbeat', FRAME_ECHO: 'echo', FRAME_EVENT: 'event'}
+    groups = {'all': frames}
+    for data in frames:
+        groups.setdefault(names[classify(data)], []).append(data)
+
+    print(f'{"frames":>10} {"count":>7} {"legacy(us)":>11} {"trybot(us)":>11} {"speedup":>8}')
+    for name, group in groups.items():
+        costs = [float('inf')] * 2
+        for _ in range(5):  # 交替运行并取最小值, 减少噪声
+            for i, func in enumerate((legacy, current)):
+                start = time.perf_counter()
+                func(group)
+                costs[i] = min(costs[i], (time.perf_counter() - start) / len(group))
+        print(f'{name:>10} {len(group):>7} {costs[0] * 1e6:>11.2f} {costs[1] * 1e6:>11.2f} {costs[0] / costs[1]:>7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
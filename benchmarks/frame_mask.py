@@ -0,0 +1,50 @@
+"""
+对比旧版逐字节掩码与 trybot.frame.encode_frame 的发送帧构造耗时
+
+运行: python benchmarks/frame_mask.py
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from trybot.frame import encode_frame
+
+
+def legacy_frame(data: bytes) -> bytes:
+    # 旧版 BotDriver._send 的实现(仅保留帧构造部分)
+    head = 1 << 15
+    head = head | (1 << 8)
+    head = head | (1 << 7)
+
+    dataLen = len(data)
+    if dataLen < 126:
+        head = (head | dataLen).to_bytes(2, 'big')
+    else:
+        head = (head | 126) if dataLen < 65536 else (head | 127)
+        head = head.to_bytes(2, 'big') + dataLen.to_bytes(2, 'big')
+
+    head += bytes([63] * 4)
+    data = bytes([b ^ 63 for b in data])
+    return head + data
+
+
+def main():
+    print(f'{"payload":>10} {"legacy(us)":>12} {"encode_frame(us)":>18} {"speedup":>9}')
+    for size in (64, 512, 4 * 1024, 60 * 1024, 64 * 1024, 1024 * 1024):
+        data = os.urandom(size)
+        number = max(3, 2 * 1024 * 1024 // size)
+
+        encode = min(timeit.repeat(lambda: encode_frame(data), number=number, repeat=3)) / number
+        if size >= 65536:   # 旧版只写入2 bytes的扩展长度, 无法构造此大小的帧
+            print(f'{size:>10} {"overflow":>12} {encode * 1e6:>18.2f} {"-":>9}')
+            continue
+
+        legacy = min(timeit.repeat(lambda: legacy_frame(data), number=number, repeat=3)) / number
+        print(f'{size:>10} {legacy * 1e6:>12.2f} {encode * 1e6:>18.2f} {legacy / encode:>8.1f}x')
+
+
+if __name__ == '__main__':
+    main()
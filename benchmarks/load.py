@@ -0,0 +1,153 @@
+"""
+在本地模拟的 OneBot 服务端上压测 trybot: 注册不同数量的插件, 统计事件吞吐、处理延迟、API往返耗时与内存
+
+运行: python benchmarks/load.py [--events 20000] [--plugins 1 50 200] [--rate 0] [--delay 0.005] [--jsonl recorded.jsonl]
+
+每个事件都是一条 "ping <序号>" 群消息, 由 ping 插件回复 "pong <序号>"; 处理延迟为服务端发出事件到收到回复的时间。
+其余插件为不会命中的全匹配插件, 用于衡量插件数量对分发的影响。传入 --jsonl 时录制的事件会与 ping 消息交替发送, 作为背景流量
+"""
+
+import os
+import sys
+import time
+import asyncio
+import logging
+import argparse
+import multiprocessing
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from onebot_server import FakeOneBot, load
+
+try:
+    import resource
+except ImportError:     # Windows
+    resource = None
+
+
+def synthesize(count: int, background: list = None) -> tuple:
+    '''
+    返回事件列表以及各 ping 消息在列表中的位置
+    '''
+    events, pings = [], []
+    for i in range(count):
+        if background:
+            events.append(background[i % len(background)])
+        pings.append(len(events))
+        user = 20000 + i % 1000     # 分散到多个会话, 避免单个会话的队列被占满
+        events.append({
+            'post_type': 'message', 'message_type': 'group', 'sub_type': 'normal', 'self_id': 10001,
+            'group_id': 12345 + i % 10, 'user_id': user, 'message_id': i, 'message': f'ping {i}',
+            'raw_message': f'ping {i}', 'font': 0, 'time': 1660000000,
+            'sender': {'user_id': user, 'nickname': '用户', 'card': '', 'role': 'member'},
+        })
+    return events, pings
+
+
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def serve(events: list, pings: list, rate: float, delay: float, conn) -> None:
+    '''
+    服务端进程: 回放事件并统计每个 ping 从发出到收到回复的耗时
+    '''
+    async def run():
+        stamps, latencies = [0] * len(events), []
+
+        def on_send(now, index):
+            stamps[index] = now
+
+        def on_action(now, action, params):
+            message = params.get('message', '')
+            if message.startswith('pong '):
+                latencies.append(now - stamps[pings[int(message[5:])]])
+                if len(latencies) >= len(pings):
+                    done.set()
+
+        done = asyncio.Event()
+        bot = FakeOneBot(events, rate, delay=delay, on_send=on_send, on_action=on_action)
+        conn.send(await bot.start())
+        try:
+            await asyncio.wait_for(done.wait(), 120)
+        except asyncio.TimeoutError:
+            pass
+        conn.send({'replies': len(latencies), 'elapsed': time.perf_counter() - stamps[0], 'latencies': latencies})
+        bot.close()
+        await asyncio.sleep(0.1)
+
+    asyncio.run(run())
+
+
+def bench(plugins: int, events: list, pings: list, rate: float, delay: float, conn) -> None:
+    '''
+    机器人进程: 注册插件并连接服务端, 直至服务端收到全部回复
+    '''
+    import trybot
+    from trybot.metrics import API_RTT
+
+    trybot.event_logger.setLevel(logging.WARNING)
+    trybot.logger.setLevel(logging.WARNING)
+
+    for i in range(plugins - 1):
+        trybot.on_full(f'关键词{i}')(lambda session: None)
+
+    @trybot.on_command('ping')
+    async def ping(session: trybot.AsyncSession):
+        await session.send_msg(f'pong {session.matched.strip()}')
+
+    parent, child = multiprocessing.Pipe()
+    server = multiprocessing.Process(target=serve, args=(events, pings, rate, delay, child), daemon=True)
+    server.start()
+    port = parent.recv()
+
+    async def run():
+        driver = trybot.default_manager.add('127.0.0.1', port)
+        scheduler = trybot.Scheduler(trybot.event_handler, 64, len(events), 'drop')
+        task = asyncio.ensure_future(driver.run(scheduler, lambda event: None))
+        result = await asyncio.get_running_loop().run_in_executor(None, parent.recv)
+        task.cancel()
+        result['dropped'] = scheduler.stats()['dropped']
+        return result
+
+    result = asyncio.run(run())
+    server.join(5)
+
+    rtt = API_RTT.values.get(('send_group_msg',))
+    result.update({
+        'rtt_mean': rtt[-2] / rtt[-1] if rtt and rtt[-1] else 0,
+        'rtt_p99': API_RTT.quantile(0.99, 'send_group_msg'),
+        'maxrss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 if resource else 0,
+    })
+    conn.send(result)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='trybot 压测')
+    parser.add_argument('--events', type=int, default=20000, help='ping 消息的数量')
+    parser.add_argument('--plugins', type=int, nargs='+', default=[1, 50, 200], help='注册的插件数量')
+    parser.add_argument('--rate', type=float, default=0, help='每秒发送的事件数, 0 为不限速')
+    parser.add_argument('--delay', type=float, default=0.005, help='服务端返回API调用前的延迟(秒)')
+    parser.add_argument('--jsonl', help='录制的事件, 作为背景流量与 ping 消息交替发送')
+    args = parser.parse_args()
+
+    events, pings = synthesize(args.events, load(args.jsonl) if args.jsonl else None)
+    print(f'{"plugins":>8} {"replies":>8} {"events/s":>9} {"p50(ms)":>8} {"p99(ms)":>8} {"rtt(ms)":>8} '
+          f'{"rtt99(ms)":>9} {"dropped":>8} {"rss(MB)":>8}')
+    for plugins in args.plugins:
+        parent, child = multiprocessing.Pipe()
+        process = multiprocessing.Process(target=bench, args=(plugins, events, pings, args.rate, args.delay, child))
+        process.start()
+        r = parent.recv()
+        process.join()
+        latencies = r['latencies']
+        print(f'{plugins:>8} {r["replies"]:>8} {len(events) / r["elapsed"]:>9.0f} '
+              f'{percentile(latencies, 0.5) * 1e3:>8.2f} {percentile(latencies, 0.99) * 1e3:>8.2f} '
+              f'{r["rtt_mean"] * 1e3:>8.2f} {r["rtt_p99"] * 1e3:>9.1f} {r["dropped"]:>8} {r["maxrss"]:>8.1f}')
+
+
+if __name__ == '__main__':
+    main()
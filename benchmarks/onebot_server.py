@@ -0,0 +1,234 @@
+"""
+本地模拟的 OneBot 正向 WebSocket 服务端, 用于在没有 go-cqhttp 的情况下测试与压测 BotDriver
+
+回放: python benchmarks/onebot_server.py serve events.jsonl [--port 6700] [--rate 100] [--delay 0.01]
+
+录制: python benchmarks/onebot_server.py record events.jsonl [--host 127.0.0.1] [--port 6700] [--count 1000]
+
+录制时连接真实的 OneBot 实现并将收到的事件(不含API返回)逐行写入 JSONL 文件, 回放时按 rate(事件/秒, 0 为不限速)发送,
+并对收到的API调用按 responses 返回固定的数据, 可设置返回前的延迟
+"""
+
+import os
+import sys
+import json
+import time
+import base64
+import asyncio
+import hashlib
+import argparse
+from typing import Callable, Dict, Iterable, List, Union
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from trybot.frame import mask, OPCODE_TEXT, OPCODE_CLOSE, OPCODE_PING, OPCODE_PONG
+from trybot.driver import WS_GUID
+
+
+def frame(payload: bytes, opcode: int = OPCODE_TEXT) -> bytes:
+    '''
+    服务端发出的数据帧无需掩码
+    '''
+    size = len(payload)
+    if size < 126:
+        header = bytes((0x80 | opcode, size))
+    elif size < 65536:
+        header = bytes((0x80 | opcode, 126)) + size.to_bytes(2, 'big')
+    else:
+        header = bytes((0x80 | opcode, 127)) + size.to_bytes(8, 'big')
+    return header + payload
+
+
+async def read_frame(reader: asyncio.StreamReader) -> tuple:
+    head = await reader.readexactly(2)
+    size = head[1] & 0x7f
+    if size == 126:
+        size = int.from_bytes(await reader.readexactly(2), 'big')
+    elif size == 127:
+        size = int.from_bytes(await reader.readexactly(8), 'big')
+    key = await reader.readexactly(4) if head[1] & 0x80 else None
+    payload = await reader.readexactly(size)
+    return head[0] & 0x0f, mask(payload, key) if key else payload
+
+
+class FakeOneBot:
+    '''
+    模拟的 OneBot 服务端, 每个连接都会收到完整的事件流
+
+    : param events: 待发送的事件(dict 或已编码的 bytes)
+
+    : param rate: 每秒发送的事件数, 0 为不限速
+
+    : param responses: API名称 -> 返回的 data, 或以 params 为参数返回 data 的函数; 未列出的API返回 {'message_id': 序号}
+
+    : param delay: 返回API调用前的延迟(秒), 也可以按API名称分别设置
+
+    : param on_send: 发出事件后的回调, 参数为 (发出的时间, 事件序号)
+
+    : param on_action: 收到API调用时的回调, 参数为 (收到的时间, action, params)
+    '''
+    def __init__(self, events: Iterable[Union[dict, bytes]], rate: float = 0,
+                 responses: Dict[str, Union[dict, Callable[[dict], dict]]] = None,
+                 delay: Union[float, Dict[str, float]] = 0, on_send: Callable[[float, int], None] = None,
+                 on_action: Callable[[float, str, dict], None] = None) -> None:
+        self.events: List[bytes] = [
+            e if isinstance(e, bytes) else json.dumps(e, ensure_ascii=False).encode() for e in events
+        ]
+        self.rate = rate
+        self.responses = responses or {}
+        self.delay = delay
+        self.on_send = on_send
+        self.on_action = on_action
+
+        self.sent = 0       # 已发送的事件数
+        self.actions = 0    # 已收到的API调用数
+        self.finished = asyncio.Event()     # 事件已全部发送
+        self.server: asyncio.AbstractServer = None
+        self.writers = set()
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0) -> int:
+        '''
+        开始监听并返回实际使用的端口
+        '''
+        self.server = await asyncio.start_server(self.__handle, host, port)
+        return self.server.sockets[0].getsockname()[1]
+
+    def close(self) -> None:
+        if self.server:
+            self.server.close()
+        for writer in self.writers:     # 关闭连接使各连接的处理协程正常结束
+            writer.close()
+
+    async def __handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        request = await reader.readuntil(b'\r\n\r\n')
+        key = b''
+        for line in request.split(b'\r\n'):
+            name, _, value = line.partition(b':')
+            if name.strip().lower() == b'sec-websocket-key':
+                key = value.strip()
+        accept = base64.b64encode(hashlib.sha1(key + WS_GUID).digest())
+        writer.write(
+            b'HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n'
+            b'Sec-WebSocket-Accept: ' + accept + b'\r\n\r\n'
+        )
+
+        feeder = asyncio.ensure_future(self.__feed(writer))
+        self.writers.add(writer)
+        try:
+            while True:
+                opcode, payload = await read_frame(reader)
+                if opcode == OPCODE_CLOSE:
+                    writer.write(frame(payload[:2], OPCODE_CLOSE))
+                    break
+                if opcode == OPCODE_PING:
+                    writer.write(frame(payload, OPCODE_PONG))
+                elif opcode == OPCODE_TEXT:
+                    self.__reply(writer, json.loads(payload))
+        except (OSError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            feeder.cancel()
+            self.writers.discard(writer)
+            writer.close()
+
+    async def __feed(self, writer: asyncio.StreamWriter) -> None:
+        start = time.perf_counter()
+        for index, data in enumerate(self.events):
+            if self.rate > 0:   # 按计划的发送时间发送, 避免误差累积
+                wait = start + self.sent / self.rate - time.perf_counter()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+            writer.write(frame(data))
+            self.sent += 1
+            if self.on_send:
+                self.on_send(time.perf_counter(), index)
+            if self.sent % 256 == 0:
+                await writer.drain()
+        await writer.drain()
+        self.finished.set()
+
+    def __reply(self, writer: asyncio.StreamWriter, body: dict) -> None:
+        self.actions += 1
+        action, params = body.get('action'), body.get('params', {})
+        if self.on_action:
+            self.on_action(time.perf_counter(), action, params)
+
+        data = self.responses.get(action, {'message_id': self.actions})
+        if callable(data):
+            data = data(params)
+        ret = frame(json.dumps({
+            'status': 'ok', 'retcode': 0, 'data': data, 'echo': body.get('echo')
+        }, ensure_ascii=False).encode())
+
+        delay = self.delay.get(action, 0) if isinstance(self.delay, dict) else self.delay
+        if delay > 0:
+            asyncio.get_running_loop().call_later(delay, self.__write, writer, ret)
+        else:
+            writer.write(ret)
+
+    @staticmethod
+    def __write(writer: asyncio.StreamWriter, data: bytes) -> None:
+        if not writer.is_closing():
+            writer.write(data)
+
+
+def load(path: str) -> List[bytes]:
+    '''
+    读取 JSONL 文件中的事件
+    '''
+    with open(path, 'rb') as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+async def record(path: str, host: str = '127.0.0.1', port: int = 6700, count: int = 1000) -> None:
+    '''
+    连接 OneBot 实现并录制收到的事件
+    '''
+    from trybot.driver import BotDriver
+    from trybot.event import classify, FRAME_ECHO
+
+    driver = BotDriver(host, port)
+    await driver.connect()
+    with open(path, 'wb') as f:
+        recorded = 0
+        while recorded < count:
+            data = await driver._recv()
+            if classify(data) != FRAME_ECHO:
+                f.write(bytes(data).replace(b'\n', b'') + b'\n')
+                recorded += 1
+    driver.disconnect('录制完成')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本地模拟的 OneBot 服务端')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    serve = commands.add_parser('serve', help='回放录制的事件')
+    serve.add_argument('path')
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=6700)
+    serve.add_argument('--rate', type=float, default=0, help='每秒发送的事件数, 0 为不限速')
+    serve.add_argument('--delay', type=float, default=0, help='返回API调用前的延迟(秒)')
+
+    rec = commands.add_parser('record', help='录制 OneBot 实现发出的事件')
+    rec.add_argument('path')
+    rec.add_argument('--host', default='127.0.0.1')
+    rec.add_argument('--port', type=int, default=6700)
+    rec.add_argument('--count', type=int, default=1000)
+
+    args = parser.parse_args()
+    if args.command == 'record':
+        asyncio.run(record(args.path, args.host, args.port, args.count))
+        return
+
+    async def run():
+        bot = FakeOneBot(load(args.path), args.rate, delay=args.delay)
+        await bot.start(args.host, args.port)
+        print(f'正在 {args.host}:{args.port} 回放 {len(bot.events)} 个事件')
+        await asyncio.Event().wait()
+
+    asyncio.run(run())
+
+
+if __name__ == '__main__':
+    main()
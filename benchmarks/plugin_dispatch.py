@@ -0,0 +1,73 @@
+"""
+对比逐个插件匹配与 PluginIndex 索引分发的单事件耗时随插件数量的变化
+
+运行: python benchmarks/plugin_dispatch.py
+"""
+
+import os
+import sys
+import time
+import asyncio
+import logging
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import trybot
+from trybot import Session, PluginPool, PluginTable
+from trybot.event import build
+
+logging.getLogger('Trybot').setLevel(logging.WARNING)
+
+
+def register(count: int) -> None:
+    PluginPool.clear()
+    for i in range(count):
+        async def handle(session):
+            pass
+        handle.__name__ = f'plugin{i}'
+
+        if i % 3 == 0:
+            trybot.on_full(f'关键词{i}')(handle)
+        elif i % 3 == 1:
+            trybot.on_command(f'命令{i}')(handle)
+        else:
+            trybot.on_regex(f'^正则{i}$')(handle)
+    PluginTable.refresh()
+
+
+async def linear(event: dict) -> None:
+    session = Session(event, None)
+    for plugin in PluginPool:
+        if await plugin(session).start_handle() and plugin.block:
+            break
+
+
+async def indexed(event: dict) -> None:
+    session = Session(event, None)
+    for plugin in PluginTable.lookup(event):
+        if await plugin(session).start_handle() and plugin.block:
+            break
+
+
+async def measure(dispatch, events: list) -> float:
+    start = time.perf_counter()
+    for event in events:
+        await dispatch(event)
+    return (time.perf_counter() - start) / len(events)
+
+
+def main():
+    print(f'{"plugins":>8} {"linear(us)":>12} {"indexed(us)":>12} {"speedup":>9}')
+    for count in (10, 100, 300, 1000):
+        register(count)
+        events = [
+            build({'post_type': 'message', 'user_id': 1, 'message': message})
+            for message in ('命令1 参数', '关键词0', '无关的消息内容', '正则2') * 250
+        ]
+        base = asyncio.run(measure(linear, events))
+        fast = asyncio.run(measure(indexed, events))
+        print(f'{count:>8} {base * 1e6:>12.1f} {fast * 1e6:>12.1f} {base / fast:>8.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""
+对比插件目录的启动耗时: 逐个导入全部插件模块与根据清单延迟导入
+
+运行: python benchmarks/plugin_loading.py
+
+在临时目录中生成指定数量的插件模块(每个模块含若干插件, 并模拟模块导入时的初始化开销),
+各方式分别在新的解释器进程中运行, 统计从开始加载到插件索引建立完成的耗时
+"""
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODULE = '''
+import re
+import time
+import trybot
+
+time.sleep({cost})   # 模拟读取配置、导入第三方库等初始化开销
+
+@trybot.on_full('关键词{i}')
+async def full{i}(session):
+    pass
+
+@trybot.on_command('命令{i}')
+async def command{i}(session):
+    pass
+
+@trybot.on_regex(r'^正则{i}\\s*(\\S+)', mode='match')
+async def regex{i}(session):
+    pass
+'''
+
+RUN = '''
+import sys, time, json, importlib
+sys.path.insert(0, {root!r})
+import trybot
+from trybot.event import build
+start = time.perf_counter()
+if {mode!r} == 'import':
+    sys.path.insert(0, {path!r})
+    for name in sorted(n[:-3] for n in __import__('os').listdir({path!r}) if n.endswith('.py')):
+        importlib.import_module(name)
+else:
+    trybot.load_plugins({path!r}, lazy={mode!r} == 'lazy')
+trybot.PluginTable.lookup(build({{'post_type': 'message', 'user_id': 1, 'message': ''}}))
+print(json.dumps([time.perf_counter() - start, len(trybot.PluginPool)]))
+'''
+
+
+def run(mode: str, path: str) -> tuple:
+    out = subprocess.run(
+        [sys.executable, '-c', RUN.format(root=ROOT, path=path, mode=mode)],
+        capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    print(f'{"modules":>8} {"plugins":>8} {"import(ms)":>11} {"first(ms)":>10} {"lazy(ms)":>9} {"speedup":>8}')
+    for count in (10, 100, 300):
+        path = tempfile.mkdtemp(prefix='trybot_plugins_')
+        try:
+            for i in range(count):
+                with open(os.path.join(path, f'plugin{i}.py'), 'w', encoding='utf-8') as f:
+                    f.write(MODULE.format(i=i, cost=0.001))
+
+            eager, plugins = run('import', path)
+            first, _ = run('eager', path)   # 首次加载, 导入全部模块并写入清单
+            lazy = min(run('lazy', path)[0] for _ in range(3))
+            print(f'{count:>8} {plugins:>8} {eager * 1e3:>11.1f} {first * 1e3:>10.1f} {lazy * 1e3:>9.1f} {eager / lazy:>7.1f}x')
+        finally:
+            shutil.rmtree(path)
+
+
+if __name__ == '__main__':
+    main()
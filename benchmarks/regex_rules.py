@@ -0,0 +1,72 @@
+"""
+对比正则插件的匹配开销: 逐个正则扫描与合并分支正则预筛选, 以及 findall 与 search 匹配方式
+
+运行: python benchmarks/regex_rules.py
+"""
+
+import os
+import re
+import sys
+import time
+import logging
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import trybot
+from trybot import PluginPool, PluginTable
+from trybot.event import build
+
+logging.getLogger('Trybot').setLevel(logging.WARNING)
+
+
+def register(count: int) -> None:
+    PluginPool.clear()
+    for i in range(count):
+        async def handle(session):
+            pass
+        handle.__name__ = f'plugin{i}'
+        trybot.on_regex(rf'查询{i}号\s*(\S+)')(handle)
+
+
+def lookup(events: list, fuse: bool) -> float:
+    PluginTable.fuse_regex = fuse
+    PluginTable.refresh()
+    PluginTable.lookup(events[0])
+    start = time.perf_counter()
+    for event in events:
+        PluginTable.lookup(event)
+    return (time.perf_counter() - start) / len(events)
+
+
+def modes(message: str) -> tuple:
+    regex = re.compile(r'\d+')
+    costs = []
+    for method in (regex.findall, regex.search):
+        start = time.perf_counter()
+        for _ in range(20000):
+            method(message)
+        costs.append((time.perf_counter() - start) / 20000)
+    return costs
+
+
+def main():
+    # 绝大多数消息不会命中任何正则插件
+    messages = ['今天天气不错', '有人一起吃饭吗' * 5, '查询3号 上海', '[CQ:face,id=1] 哈哈哈'] + ['普通的群聊消息内容' * 3] * 6
+    events = [build({'post_type': 'message', 'user_id': 1, 'message': m}) for m in messages] * 200
+
+    print(f'{"plugins":>8} {"separate(us)":>13} {"fused(us)":>10} {"speedup":>8}')
+    for count in (2, 10, 50, 200):
+        register(count)
+        costs = [float('inf')] * 2
+        for _ in range(3):
+            for i, fuse in enumerate((False, True)):
+                costs[i] = min(costs[i], lookup(events, fuse))
+        print(f'{count:>8} {costs[0] * 1e6:>13.2f} {costs[1] * 1e6:>10.2f} {costs[0] / costs[1]:>7.1f}x')
+
+    message = '编号 ' + ' '.join(str(i) for i in range(200))
+    findall, search = modes(message)
+    print(f'\n正则 \\d+ 匹配含 200 个数字的消息: findall {findall * 1e6:.2f}us, search {search * 1e6:.2f}us')
+
+
+if __name__ == '__main__':
+    main()
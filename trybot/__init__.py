@@ -4,63 +4,156 @@ Created on February 13 at 11:26 2022
 """
 
 import asyncio
-import threading
+import logging
+from typing import List, Tuple
 
 from .plugin import *
-from .logger import logger
-from .session import Session
+from .logger import logger, event_logger, setup_logging
+from .session import Session, AsyncSession
+from concurrent.futures import ThreadPoolExecutor
+from .event import Event, MessageEvent, NoticeEvent, RequestEvent, MetaEvent
 from .driver import BotDriver
+from .scheduler import Scheduler
+from .sender import Sender
+from .cache import ApiCache
+from .state import State, StateStore
+from .loader import load_plugins, reload_module, watch_plugins
+from .manager import DriverManager
+from .worker import WorkerPool
+from .metrics import metrics, serve_metrics, log_metrics, QUEUE_DEPTH
 
 
 default_driver: BotDriver = None
+default_manager = DriverManager()
 
 
-def event_printer(event: dict):
-    if 'group_id' in event and event['post_type'] == 'message':
-        name = event['sender']['card']
-        logger.info(
-            '收到群聊(%d)内 %s(%d) 消息: %s' %
-            (
-                event['group_id'],
-                name if name else event['sender']['nickname'],
-                event['user_id'],
-                event['message']
-            ))
-    elif 'user_id' in event and event['post_type'] == 'message':
-        logger.info(
+def event_printer(event: Event):
+    if not event_logger.isEnabledFor(logging.INFO):
+        return
+    if isinstance(event, MessageEvent) and event.group_id:
+        event_logger.info(
+            '收到群聊(%d)内 %s(%d) 消息: %s',
+            event.group_id,
+            event.name,
+            event.user_id,
+            event.message
+        )
+    elif isinstance(event, MessageEvent):
+        event_logger.info(
             '收到私聊 %s(%d) 消息: %s',
             event['sender']['nickname'],
-            event['user_id'],
-            event['message']
+            event.user_id,
+            event.message
         )
     else:
-        logger.info("收到事件: " + event.__str__())
+        event_logger.info('收到事件: %s', event)
 
 
-async def event_handler(event: dict):
-    session = Session(event, default_driver)
-    for plugin in PluginPool:
+async def event_handler(event: Event, driver: BotDriver = None):
+    session = Session(event, driver or default_manager.route(event))
+    for plugin in PluginTable.lookup(event):
         ret = await plugin(session).start_handle()
         if ret and plugin.block:
             break   # 截断后续执行
 
 
-def run_bot(host: str = '127.0.0.1', port: int = 6700):
+def run_bot(host: str = '127.0.0.1', port: int = 6700, workers: int = 16,
+            concurrency: int = 64, queue_size: int = 100, policy: str = 'drop',
+            connections: List[Tuple[str, int]] = None, processes: int = 0, plugins: List[str] = None,
+            metrics_port: int = 0, metrics_interval: float = 0, plugin_dir: str = None, reload_interval: float = 0):
+    '''
+    连接 OneBot 并开始处理事件
+
+
+    : param workers: 执行同步插件处理函数的线程数
+
+    : param concurrency: 同时处理的事件上限
+
+    : param queue_size: 每个会话排队等待的事件上限
+
+    : param policy: 会话队列已满时的策略, 'drop' 丢弃最早的事件, 'block' 暂停读取新事件
+
+    : param connections: 同时连接多个账号时传入 [(host, port), ...], 此时忽略 host 与 port
+
+    : param processes: 大于0时启用多进程模式, 当前进程只负责收发, 事件按会话分发给指定数量的工作进程处理
+
+    : param plugins: 多进程模式下工作进程需要导入的插件模块名, 以 spawn 方式启动进程时需要提供
+
+    : param metrics_port: 大于0时在 127.0.0.1 的该端口以 Prometheus 文本格式导出运行指标
+
+    : param metrics_interval: 大于0时每隔该秒数将运行指标的摘要写入日志
+
+    : param plugin_dir: 插件目录的路径或插件包的模块名, 连接前加载其中的全部插件模块, 未变化的模块延迟到首次匹配时导入(见 load_plugins)
+
+    : param reload_interval: 大于0时每隔该秒数检查 plugin_dir, 重新加载发生变化的插件模块而不断开连接(见 watch_plugins)
+    '''
     global default_driver
-    default_driver = BotDriver(host, port)
-    loop = asyncio.get_event_loop()
-    threading.Thread(
-        args=(loop, event_handler, event_printer),
-        target=default_driver.listen
-    ).start()
+    for host, port in connections or [(host, port)]:
+        default_manager.add(host, port)
+    default_driver = default_manager.drivers[0]
+    if plugin_dir:
+        load_plugins(plugin_dir)
+    Plugin.executor = ThreadPoolExecutor(workers, thread_name_prefix='trybot')
+
+    async def serve():
+        if processes > 0:
+            scheduler = WorkerPool(
+                default_manager, processes, plugins, workers, concurrency, queue_size, policy,
+                plugin_dir and [plugin_dir], reload_interval
+            )
+            scheduler.start(asyncio.get_running_loop())
+        else:
+            scheduler = Scheduler(event_handler, concurrency, queue_size, policy)
+
+        @metrics.on_collect
+        def collect():
+            if isinstance(scheduler, Scheduler):
+                stats = scheduler.stats()
+                QUEUE_DEPTH.set(stats['active'], 'scheduler_active', '')
+                QUEUE_DEPTH.set(stats['waiting'], 'scheduler_waiting', '')
+                QUEUE_DEPTH.set(stats['queued'], 'scheduler_queued', '')
+            for driver in default_manager.drivers:
+                bot = f'{driver.host}:{driver.port}'
+                sender = driver.sender.stats()
+                QUEUE_DEPTH.set(len(driver.waiter), 'waiter', bot)
+                QUEUE_DEPTH.set(len(driver.backer), 'backer', bot)
+                QUEUE_DEPTH.set(sender['priority'], 'sender_priority', bot)
+                QUEUE_DEPTH.set(sender['queued'], 'sender_queued', bot)
+                QUEUE_DEPTH.set(len(driver.cache), 'cache', bot)
+
+        background = []     # 保留后台任务的引用, 以免被回收
+        if metrics_port > 0:
+            await serve_metrics('127.0.0.1', metrics_port)
+        if metrics_interval > 0:
+            background.append(asyncio.ensure_future(log_metrics(metrics_interval)))
+        if reload_interval > 0 and processes <= 0:
+            background.append(asyncio.ensure_future(watch_plugins(default_manager.drivers, reload_interval)))
+        await default_manager.run(scheduler, event_printer)
 
-    loop.run_forever()
+    asyncio.run(serve())
 
 
 __all__ = [
     'Session',
+    'AsyncSession',
+    'Event',
+    'MessageEvent',
+    'NoticeEvent',
+    'RequestEvent',
+    'MetaEvent',
     'BotDriver',
+    'Scheduler',
+    'Sender',
+    'ApiCache',
+    'State',
+    'StateStore',
+    'DriverManager',
     'run_bot',
+    'load_plugins',
+    'reload_module',
+    'watch_plugins',
+    'setup_logging',
+    'metrics',
     'on_event',
     'on_full',
     'on_fulls',
@@ -0,0 +1,158 @@
+"""
+此模块提供读取类API的本地缓存, 按 LRU 淘汰并设有过期时间
+"""
+
+import asyncio
+from copy import deepcopy
+from .event import NoticeEvent
+from collections import OrderedDict
+from typing import Dict
+
+
+class ApiCache:
+    '''
+    get_group_info / get_group_member_info / get_msg 的本地缓存
+
+    - 缓存项在 ttl 中对应的秒数后过期, 总数超过 max_size 时淘汰最久未使用的项
+
+    - 同一缓存项的并发请求只会发送一次API调用, 其余请求等待该调用的返回
+
+    - no_cache=True 的请求不读取缓存, 但会用返回结果刷新缓存
+
+    - 每个请求得到的都是返回结果的副本, 插件修改返回结果不会影响缓存与其它请求
+
+    - 收到群名片、管理员、成员增减、禁言、撤回等通知事件或发出对应的管理操作时, 使相关缓存项失效
+
+    以上参数的默认值为类属性, 可以通过 ApiCache.max_size = 0 关闭缓存, 或修改某个连接的 driver.cache
+
+    : param driver: 实际发送调用的驱动(使用其 sender)
+    '''
+    ttl: Dict[str, float] = {
+        'get_group_info': 300,
+        'get_group_member_info': 60,
+        'get_msg': 600,
+    }
+    max_size: int = 4096
+
+    def __init__(self, driver) -> None:
+        self.driver = driver
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0      # 等待同一进行中调用而未重复发送的请求数
+        self.invalidated = 0
+
+        self.__items: Dict[tuple, tuple] = OrderedDict()    # key -> (过期时间, 返回值)
+        self.__pending: Dict[tuple, asyncio.Future] = {}
+
+    def __len__(self) -> int:
+        return len(self.__items)
+
+    def stats(self) -> dict:
+        return {
+            'size': len(self.__items),
+            'hits': self.hits,
+            'misses': self.misses,
+            'coalesced': self.coalesced,
+            'invalidated': self.invalidated,
+        }
+
+    @staticmethod
+    def key(action: str, params: dict) -> tuple:
+        if action == 'get_msg':
+            return (action, params.get('message_id'))
+        return (action, params.get('group_id'), params.get('user_id'))
+
+    async def call(self, action: str, params: dict, timeout: float = 30) -> dict:
+        '''
+        优先从缓存中返回API调用结果, 未命中时经由 driver.sender 发送调用
+        '''
+        if action not in self.ttl or self.max_size <= 0:
+            return await self.driver.sender.call(action, params, timeout)
+
+        key = self.key(action, params)
+        loop = asyncio.get_running_loop()
+        if not params.get('no_cache'):
+            item = self.__items.get(key)
+            if item and item[0] > loop.time():
+                self.__items.move_to_end(key)
+                self.hits += 1
+                return deepcopy(item[1])
+
+            pending = self.__pending.get(key)
+            if pending:
+                self.coalesced += 1
+                return deepcopy(await asyncio.shield(pending))
+
+        self.misses += 1
+        future = self.__pending[key] = loop.create_future()
+        try:
+            ret = await self.driver.sender.call(action, params, timeout)
+            if ret is not None and ret.get('status') != 'failed' and self.__pending.get(key) is future:
+                self.__store(key, ret, loop.time() + self.ttl[action])
+            future.set_result(ret)
+            return deepcopy(ret)
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # 无其它请求等待时避免 "exception was never retrieved"
+            raise
+        finally:
+            if self.__pending.get(key) is future:
+                del self.__pending[key]
+
+    def __store(self, key: tuple, ret: dict, expire: float) -> None:
+        self.__items[key] = (expire, ret)
+        self.__items.move_to_end(key)
+        while len(self.__items) > self.max_size:
+            self.__items.popitem(last=False)
+
+    def invalidate(self, action: str, group_id: int = None, user_id: int = None, message_id: int = None) -> None:
+        '''
+        使缓存项失效, user_id 为 None 时使该群所有的成员信息失效
+
+        进行中的同一调用的返回不会再写入缓存
+        '''
+        if action == 'get_msg':
+            keys = [(action, message_id)]
+        elif user_id is None and action == 'get_group_member_info':
+            keys = [k for k in self.__items if k[0] == action and k[1] == group_id]
+        else:
+            keys = [(action, group_id, user_id)]
+        for key in keys:
+            self.__pending.pop(key, None)
+            if self.__items.pop(key, None) is not None:
+                self.invalidated += 1
+
+    def notice(self, event: NoticeEvent) -> None:
+        '''
+        根据通知事件使相关缓存项失效
+        '''
+        notice_type = event.notice_type
+        if notice_type in ('group_card', 'group_admin', 'group_ban'):
+            if event.user_id:
+                self.invalidate('get_group_member_info', event.group_id, event.user_id)
+            else:   # 全员禁言
+                self.invalidate('get_group_member_info', event.group_id)
+        elif notice_type in ('group_increase', 'group_decrease'):
+            self.invalidate('get_group_info', event.group_id)
+            self.invalidate('get_group_member_info', event.group_id, event.user_id)
+            if event.user_id == event.get('self_id'):   # 机器人自身退群或被踢
+                self.invalidate('get_group_member_info', event.group_id)
+        elif notice_type in ('group_recall', 'friend_recall'):
+            self.invalidate('get_msg', message_id=event.get('message_id'))
+
+    def action(self, action: str, params: dict) -> None:
+        '''
+        根据发出的管理操作使相关缓存项失效
+        '''
+        if action in ('set_group_card', 'set_group_admin', 'set_group_ban', 'set_group_kick', 'set_group_special_title'):
+            self.invalidate('get_group_member_info', params.get('group_id'), params.get('user_id'))
+        elif action == 'set_group_whole_ban':
+            self.invalidate('get_group_member_info', params.get('group_id'))
+        elif action == 'set_group_name':
+            self.invalidate('get_group_info', params.get('group_id'))
+        elif action == 'delete_msg':
+            self.invalidate('get_msg', message_id=params.get('message_id'))
+
+
+__all__ = ['ApiCache']
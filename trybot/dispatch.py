@@ -0,0 +1,119 @@
+"""
+此模块提供插件的索引分发, 避免每个事件都遍历全部插件
+"""
+
+import re
+from .event import Event, MessageEvent
+from typing import Dict, List
+
+
+class PluginIndex:
+    '''
+    插件索引
+
+    根据插件注册时声明的触发条件(trigger)建立索引:
+
+    - full: 关键词 -> 插件 的哈希表
+
+    - command: 命令前缀树, 沿消息逐字符查找全部前缀命令
+
+    - regex: 注册时预编译的正则; fuse_regex 为 True 且有多个正则时, 先用全部正则合并成的一个分支正则扫描消息,
+      未命中时即可跳过全部正则插件, 命中时再逐个检查
+
+    未声明触发条件的插件(如直接使用 on_event)对每个事件都是候选
+
+    lookup 返回的候选插件保持 PluginPool 中的优先级顺序
+    '''
+    fuse_regex: bool = True
+
+    def __init__(self, pool: list) -> None:
+        self.pool = pool
+        self.dirty = True
+
+    def refresh(self) -> None:
+        '''
+        标记插件池已变化, 下次查找时重建索引
+        '''
+        self.dirty = True
+
+    def rebuild(self) -> None:
+        self.rank: Dict[type, int] = {}
+        self.generic: List[type] = []
+        self.fulls: Dict[str, List[type]] = {}
+        self.commands: list = [{}, []]    # 前缀树节点: [子节点, 以此结尾的命令所属插件]
+        self.regexes: list = []
+        self.fused: re.Pattern = None
+
+        self.pool.sort(key=lambda p: p.priority)    # 稳定排序, 同优先级的插件保持注册顺序
+        for rank, plugin in enumerate(self.pool):
+            self.rank[plugin] = rank
+            if plugin.trigger is None:
+                self.generic.append(plugin)
+                continue
+
+            kind, values = plugin.trigger
+            for value in values:
+                if kind == 'full':
+                    self.fulls.setdefault(value, []).append(plugin)
+                elif kind == 'command':
+                    node = self.commands
+                    for char in value:
+                        node = node[0].setdefault(char, [{}, []])
+                    node[1].append(plugin)
+                elif kind == 'regex':
+                    self.regexes.append((re.compile(value), plugin))
+        if self.fuse_regex and len(self.regexes) > 1:
+            self.fused = self.fuse([pattern for pattern, _ in self.regexes])
+        self.dirty = False
+
+    @staticmethod
+    def fuse(patterns: List[re.Pattern]) -> re.Pattern:
+        '''
+        将多个正则合并为一个分支正则, 无法合并(标志不同、含反向引用或条件引用、命名组重名或全局内联标志等)时返回 None
+
+        反向引用与条件引用 (?(1)...) 按组号或组名引用, 合并后会指向其它分支的组, 因此不合并
+
+        各分支使用非捕获组: 以命名组包裹分支会使 re 无法利用分支的前缀与首字符进行快速跳过, 反而比逐个扫描更慢
+        '''
+        flags = patterns[0].flags
+        if any(p.flags != flags or re.search(r'\\\d|\(\?P=|\(\?\(', p.pattern) for p in patterns):
+            return None
+        try:
+            return re.compile('|'.join(f'(?:{p.pattern})' for p in patterns), flags)
+        except re.error:
+            return None
+
+    def lookup(self, event: Event) -> List[type]:
+        '''
+        获取可能处理此事件的候选插件
+        '''
+        if self.dirty:
+            self.rebuild()
+
+        if not isinstance(event, MessageEvent):
+            return self.generic
+
+        message = event.text
+
+        matched = list(self.generic)
+        matched += self.fulls.get(message, ())
+
+        node = self.commands
+        matched += node[1]
+        for char in message:
+            node = node[0].get(char)
+            if node is None:
+                break
+            matched += node[1]
+
+        if self.fused is None or self.fused.search(message):
+            for pattern, plugin in self.regexes:
+                if pattern.search(message):
+                    matched.append(plugin)
+
+        if len(matched) > len(self.generic):
+            matched = sorted(set(matched), key=self.rank.__getitem__)
+        return matched
+
+
+__all__ = ['PluginIndex']
@@ -2,110 +2,264 @@
 此模块提供与 OneBot 的正向 websocket 通信
 """
 
-import sys
-import json
-import queue
-import socket
+import os
+import base64
+import random
 import asyncio
-from .logger import logger
-from typing import Dict, Generator
+import hashlib
+import itertools
+from .frame import *
+from .event import *
+from .logger import logger, event_logger
+from .waiter import Waiter
+from collections import deque
+from .cache import ApiCache
+from .metrics import EVENTS, API_RTT, API_TIMEOUTS
+from .sender import Sender
+from .scheduler import Scheduler
+from typing import Dict, Union
 
 
-class Waiter(dict):
-    async def wait(self, uid:int, ret:Generator):
-        self[uid] = ret
-        for _ in range(60):
-            if not uid in self:
-                return False
-            await asyncio.sleep(0.5)
-        logger.error(f'等待会话输入[{uid}] -> 超时......')
-        return True
+# 用于计算 Sec-WebSocket-Accept 的固定GUID(RFC 6455)
+WS_GUID = b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
 
 
 class BotDriver:
     def __init__(self, host: str, port: int) -> None:
-        # 建立Tcp Socket连接
-        self.__sock = socket.socket()
-        self.__sock.connect((host, port))
+        self.host = host
+        self.port = port
+        self.loop: asyncio.AbstractEventLoop = None
+        self.connected = False
+        self.self_id: int = None    # 当前连接登录的账号, 收到事件后得知
 
+        self.backer: Dict[int, asyncio.Future] = {}
+        self.waiter = Waiter()
+        self.sender = Sender(self)
+        self.cache = ApiCache(self)
+        self.__echo = itertools.count(1)
+
+        # 收到首个心跳后, 超过3个心跳周期未收到任何数据即视为连接已失效
+        self.heartbeat: float = 0
+        self.__heartbeat_timeout: float = None
+
+    async def connect(self, timeout: float = 10) -> None:
+        '''
+        建立 WebSocket 连接, 失败时抛出 ConnectionError
+        '''
+        # 在当前事件循环内建立Tcp连接
+        self.loop = asyncio.get_running_loop()
+        self.__reader, self.__writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port), timeout
+        )
+        self.__decoder = FrameDecoder()
+        self.__messages = deque()
+        self.__closed = False
+
+        try:
+            await self.__handshake(timeout)
+        except BaseException:   # 握手超时、连接中断或校验失败时均需关闭连接, 以免每次重试泄漏一个套接字
+            self.__writer.close()
+            raise
+
+        self.connected = True
+        self.__heartbeat_timeout = None
+        logger.info(f'发出 WebSocket 连接: {self.host}:{self.port} -> 成功')
+
+    async def __handshake(self, timeout: float) -> None:
         # 发送Websocket握手请求
-        self.__sock.send(b'\n'.join([
+        key = base64.b64encode(os.urandom(16))
+        self.__writer.write(b'\r\n'.join([
             b'GET /ws HTTP/1.1',
-            b'Host: 127.0.0.1:6700',
+            f'Host: {self.host}:{self.port}'.encode(),
             b'Connection: Upgrade',
             b'Upgrade: websocket',
             b'Sec-WebSocket-Version: 13',
-            b'Sec-WebSocket-Key: Bt4+Nfq12qxyxHslV2iFFg==\n\n'
+            b'Sec-WebSocket-Key: ' + key + b'\r\n\r\n'
         ]))
 
         # 判断Websocket Client是否创建成功
-        ret = self.__sock.recv(1024)
-        if not b'Sec-WebSocket-Accept' in ret:
-            logger.warning(f'发出 WebSocket 连接: {host}:{port} -> 失败')
-            sys.exit("ERROR: " + ret.__str__()[2:-1])
-        logger.info(f'发出 WebSocket 连接: {host}:{port} -> 成功')
-
-    def _send(self, data: bytes) -> None:
-        # FIN(1 bit): 表示该消息是否结束
-        # RSV(3*1 bit): 除扩展协议外一般为0值
-        # OPCODE(4 bit): 表数据类型
-        # Mask（1 bit): 表示是否需要进行掩码计算
-        # Payload length(7/7+16/7+64 bits): 大小视数据长度而定
-        # Masking-key(0 bit/4 bytes): 一个4 bytes大小用于掩码计算的key
-        head = 1 << 15  # 0b1000000000000000
-        head = head | (1 << 8)  # OPCODE_TEXT 文本数据
-        head = head | (1 << 7)  # 此处代表需要掩码计算
-
-        # 判断 Payload length
-        dataLen = len(data)
-        if dataLen < 126:
-            head = (head | dataLen).to_bytes(2, 'big')
+        try:
+            ret = await asyncio.wait_for(self.__reader.readuntil(b'\r\n\r\n'), timeout)
+        except asyncio.LimitOverrunError:
+            raise ConnectionError('WebSocket 握手响应过长') from None
+        status, *lines = ret.decode('latin-1').split('\r\n')
+        headers = dict(
+            (name.strip().lower(), value.strip())
+            for name, _, value in (line.partition(':') for line in lines)
+        )
+        accept = base64.b64encode(hashlib.sha1(key + WS_GUID).digest()).decode()
+        if status.split(' ')[1:2] != ['101'] or headers.get('sec-websocket-accept') != accept:
+            logger.warning(f'发出 WebSocket 连接: {self.host}:{self.port} -> 失败')
+            raise ConnectionError(f'WebSocket 握手失败: {status}')
+
+    def disconnect(self, reason: str) -> None:
+        '''
+        关闭当前连接, 并使所有等待返回的API调用立即失败
+        '''
+        self.connected = False
+        self.__writer.close()
+        logger.warning(f'WebSocket 连接: {self.host}:{self.port} -> {reason}')
+
+        for future in self.backer.values():
+            if not future.done():
+                future.set_exception(ConnectionResetError(reason))
+        self.backer.clear()
+
+    async def run(self, scheduler: Scheduler, event_printer=print, min_delay: float = 1, max_delay: float = 60):
+        '''
+        保持连接并监听事件, 断开后按带随机抖动的指数退避自动重连
+
+        : param min_delay: 首次重连前的等待时间(秒)
+
+        : param max_delay: 重连等待时间的上限(秒)
+        '''
+        delay = min_delay
+        while True:
+            try:
+                await self.connect()
+                delay = min_delay
+                await self.listen(scheduler, event_printer)
+            except (OSError, EOFError, WebSocketError, asyncio.TimeoutError) as e:
+                if self.connected:
+                    self.disconnect(repr(e))
+                else:
+                    logger.warning(f'发出 WebSocket 连接: {self.host}:{self.port} -> {e!r}')
+
+            wait = delay * random.uniform(0.5, 1.5)
+            logger.info(f'将在{wait:.1f}秒后重新连接 WebSocket: {self.host}:{self.port}')
+            await asyncio.sleep(wait)
+            delay = min(delay * 2, max_delay)
+
+    def in_loop(self) -> bool:
+        '''
+        判断当前是否处于驱动所在的事件循环线程内
+        '''
+        try:
+            return asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            return False
+
+    def _send(self, data: bytes, opcode: int = OPCODE_TEXT) -> None:
+        frame = encode_frame(data, opcode)
+
+        # StreamWriter 非线程安全, 其它线程的写入需交由事件循环执行
+        if self.in_loop():
+            self.__write(frame)
         else:
-            head = (head | 126) if dataLen < 65536 else (head | 127)
-            head = head.to_bytes(2, 'big') + dataLen.to_bytes(2, 'big')
+            self.loop.call_soon_threadsafe(self.__write, frame)
 
-        # 进行掩码计算
-        head += bytes([63] * 4)  # Masking-key
-        data = bytes([b ^ 63 for b in data])  # 相同byte进行计算比较方便
+    def __write(self, frame: bytes) -> None:
+        if self.connected:
+            self.__writer.write(frame)
 
-        self.__sock.send(head + data)
+    async def _recv(self) -> bytes:
+        # 一次读取可能包含多个数据帧, 也可能只有半个, 交由解析器拼接
+        while not self.__messages:
+            if self.__closed:
+                raise ConnectionResetError('WebSocket 连接已关闭')
 
-    def _recv(self) -> bytes:
-        # go-cqhttp传输的websocket数据包格式均为OPCODE_TEXT
-        # go-cqhttp传输的websocket数据包是没有进行掩码计算的
-        data = self.__sock.recv(1024 * 8)
-        data = data[2:] if len(data) < 126 else data[4:]
-        return data
+            try:
+                data = await asyncio.wait_for(self.__reader.read(64 * 1024), self.__heartbeat_timeout)
+            except asyncio.TimeoutError:
+                raise asyncio.TimeoutError('心跳超时, 连接已失效') from None
+            if not data:
+                raise ConnectionResetError('WebSocket 连接已断开')
+
+            for opcode, payload in self.__decoder.feed(data):
+                if opcode == OPCODE_PING:
+                    self._send(payload, OPCODE_PONG)
+                elif opcode == OPCODE_CLOSE:
+                    self._send(payload[:2], OPCODE_CLOSE)
+                    self.__closed = True
+                elif opcode != OPCODE_PONG:
+                    self.__messages.append(payload)
+        return self.__messages.popleft()
 
     def send(self, body: dict):
-        data = json.dumps(body)
-        self._send(data.encode())
+        self._send(encode(body))
+
+    async def call_action(self, action: str, params: dict, timeout: float = 30) -> dict:
+        '''
+        经由缓存(见 ApiCache)与发送队列(见 Sender)发送API调用并等待其返回, 超时返回 None
+        '''
+        self.cache.action(action, params)
+        return await self.cache.call(action, params, timeout)
+
+    async def request(self, action: str, params: dict, timeout: float = 30) -> dict:
+        '''
+        立即发送API调用并等待其返回, 超时返回 None
+
+        每次调用使用独立递增的echo, 由 listen 按echo将返回分发给对应的 Future
+
+        连接断开时等待中的调用会立即失败并返回 None
+        '''
+        if not self.connected:
+            logger.error(f"发送API[{action}]调用 -> WebSocket 未连接")
+            return None
+
+        echo = next(self.__echo)
+        future = self.loop.create_future()
+        self.backer[echo] = future
+
+        self.send({"action": action, "params": params, "echo": echo})
+        event_logger.info('发送API[%s]调用 <- %s', action, params)
+        start = self.loop.time()
+        try:
+            ret = await asyncio.wait_for(future, timeout)
+            API_RTT.observe(self.loop.time() - start, action)
+            return ret
+        except asyncio.TimeoutError:
+            API_TIMEOUTS.inc(action)
+            logger.error(f"接收API[{action}]返回 -> 超时......")
+        except ConnectionError as e:
+            logger.error(f"接收API[{action}]返回 -> 连接已断开: {e}")
+        finally:
+            self.backer.pop(echo, None)
 
-    def recv(self) -> dict:
-        data = self._recv()
-        return json.loads(data)
+    async def recv(self) -> Union[Event, dict]:
+        data = await self._recv()
+        return decode(data)
 
-    def listen(self, main_loop, event_handler, event_printer=print):
-        self.backer = queue.Queue(maxsize=20)
-        self.waiter: Dict[int, Generator] = Waiter()
+    def __beat(self, interval: int) -> None:
+        self.heartbeat = self.loop.time()
+        self.__heartbeat_timeout = interval * 3 / 1000
 
+    async def listen(self, scheduler: Scheduler, event_printer=print):
+        '''
+        循环接收事件直至连接断开(抛出 ConnectionError 或 asyncio.TimeoutError)
+        '''
         while True:
-            event = self.recv()
-            if 'echo' in event:  # API调用返回
-                self.backer.put(event)
-            elif 'meta_event_type' in event:  # 忽略心跳事件
+            data = await self._recv()
+            if is_heartbeat(data):  # 心跳事件无需解析, 仅用于检测连接状态
+                EVENTS.inc('meta_event')
+                self.__beat(heartbeat_interval(data))
+                continue
+
+            try:
+                event = decode(data)
+            except ValueError as e:     # 无法解析的数据帧只跳过, 不影响后续事件
+                logger.warning(f'WebSocket 连接: {self.host}:{self.port} -> 收到无法解析的数据帧: {e!r}')
+                continue
+            if not isinstance(event, Event):  # API调用返回
+                future = self.backer.pop(event['echo'], None)
+                if future and not future.done():
+                    future.set_result(event)
+                continue
+
+            EVENTS.inc(event.get('post_type'))
+            self.self_id = event.get('self_id', self.self_id)
+            if isinstance(event, MetaEvent):  # 其它元事件无需交给插件处理
+                if event.meta_event_type == 'heartbeat':
+                    self.__beat(event.get('interval', 5000))
+                continue
+
+            event_printer(event)
+            if isinstance(event, MessageEvent) and event.key in self.waiter:  # 会话等待, 规则收到纯文本, 回复事件保存至 session.reply
+                self.waiter.resolve(event.key, event)
                 continue
-            elif event.get('user_id', 0) in self.waiter:    # 会话等待
-                event_printer(event)
-                ret = self.waiter[event['user_id']]
-                ret.send(event['message'])
-                del self.waiter[event['user_id']]
-            else:   # 调用event_handle处理事件
-                event_printer(event)
-                asyncio.run_coroutine_threadsafe(
-                    loop=main_loop,
-                    coro=event_handler(event)
-                )
+            if isinstance(event, NoticeEvent):  # 通知事件可能使API缓存失效
+                self.cache.notice(event)
+            await scheduler.put(event)  # 交由调度器在同一事件循环内调用event_handle处理事件
 
 
 __all__ = ['BotDriver']
@@ -0,0 +1,246 @@
+"""
+此模块提供 OneBot 事件数据的编解码
+"""
+
+import re
+import json
+from typing import Union
+from .waiter import Waiter
+from .message import Message, parse, unescape
+
+
+FRAME_EVENT = 0
+FRAME_ECHO = 1
+FRAME_HEARTBEAT = 2
+
+# 字符串内容中的引号均被转义为 \", 因此以下模式只会匹配到真正的字段
+_ECHO = re.compile(rb'"echo"\s*:')
+_HEARTBEAT = re.compile(rb'"meta_event_type"\s*:\s*"heartbeat"')
+_INTERVAL = re.compile(rb'"interval"\s*:\s*(\d+)')
+
+# 复用同一个紧凑格式的编码器, 中文不再转义为 \uXXXX
+_encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+
+
+class Event(dict):
+    '''
+    OneBot 事件
+
+    继承 dict 以兼容 event['message'] 等用法, 由驱动在收到数据时按 post_type 创建一次:
+
+    MessageEvent / NoticeEvent / RequestEvent / MetaEvent, 常用字段在创建时即读取为属性,
+
+    由嵌套字段派生的值在首次访问时计算并缓存
+    '''
+    __slots__ = ('_key', '_name')   # 不定义 __init__, 创建时与 dict 的开销相同
+
+    def setup(self) -> None:
+        '''
+        创建后读取常用字段
+        '''
+
+    @property
+    def key(self) -> tuple:
+        '''
+        事件所属会话的键, 见 Waiter.key
+        '''
+        try:
+            return self._key
+        except AttributeError:
+            self._key = Waiter.key(self)
+            return self._key
+
+    @property
+    def name(self) -> str:
+        '''
+        发送者的群名片, 未设置时为昵称
+        '''
+        try:
+            return self._name
+        except AttributeError:
+            sender = self.get('sender') or {}
+            self._name = sender.get('card') or sender.get('nickname', '')
+            return self._name
+
+
+class MessageEvent(Event):
+    '''
+    消息事件
+
+    text / segments / at_me / images 在首次访问时解析并缓存, 由处理同一事件的全部插件共享
+    '''
+    __slots__ = ('message_type', 'user_id', 'group_id', 'message', '_text', '_segments', '_at_me', '_images')
+
+    def setup(self) -> None:
+        self.message_type = self.get('message_type', '')
+        self.user_id = self.get('user_id', 0)
+        self.group_id = self.get('group_id', 0)
+        self.message = self.get('message', '')
+        self._key = (self.get('self_id', 0), self.group_id, self.user_id)
+
+    @property
+    def text(self) -> str:
+        '''
+        纯文本内容(去除 CQ 码等非文本消息段), 插件的关键词、命令与正则均匹配此内容
+        '''
+        try:
+            return self._text
+        except AttributeError:
+            if isinstance(self.message, str) and '[CQ:' not in self.message:   # 纯文本消息无需解析
+                self._text = unescape(self.message).strip()
+            else:
+                self._text = self.segments.plain_text()
+            return self._text
+
+    @property
+    def segments(self) -> Message:
+        '''
+        消息段列表
+        '''
+        try:
+            return self._segments
+        except AttributeError:
+            self._segments = parse(self.message)
+            return self._segments
+
+    @property
+    def at_me(self) -> bool:
+        '''
+        消息中是否@了机器人
+        '''
+        try:
+            return self._at_me
+        except AttributeError:
+            self._at_me = str(self.get('self_id')) in self.segments.at()
+            return self._at_me
+
+    @property
+    def images(self) -> list:
+        '''
+        消息中图片的链接
+        '''
+        try:
+            return self._images
+        except AttributeError:
+            self._images = self.segments.images()
+            return self._images
+
+
+class NoticeEvent(Event):
+    '''
+    通知事件
+    '''
+    __slots__ = ('notice_type', 'user_id', 'group_id')
+
+    def setup(self) -> None:
+        self.notice_type = self.get('notice_type', '')
+        self.user_id = self.get('user_id', 0)
+        self.group_id = self.get('group_id', 0)
+        self._key = (self.get('self_id', 0), self.group_id, self.user_id)
+
+
+class RequestEvent(Event):
+    '''
+    请求事件
+    '''
+    __slots__ = ('request_type', 'user_id', 'group_id')
+
+    def setup(self) -> None:
+        self.request_type = self.get('request_type', '')
+        self.user_id = self.get('user_id', 0)
+        self.group_id = self.get('group_id', 0)
+        self._key = (self.get('self_id', 0), self.group_id, self.user_id)
+
+
+class MetaEvent(Event):
+    '''
+    元事件
+    '''
+    __slots__ = ('meta_event_type', )
+
+    def setup(self) -> None:
+        self.meta_event_type = self.get('meta_event_type', '')
+
+
+EVENT_TYPES = {
+    'message': MessageEvent,
+    'notice': NoticeEvent,
+    'request': RequestEvent,
+    'meta_event': MetaEvent,
+}
+
+
+def is_heartbeat(data: bytes) -> bool:
+    '''
+    在完整解析之前, 根据原始数据判断是否为心跳数据帧
+
+    心跳数据帧很短, 只对较短的数据帧做判断, 较长的事件无需扫描; 未被识别的心跳仍会作为 meta_event 事件解析
+    '''
+    # 先用子串查找快速排除, 再用正则确认
+    return len(data) < 1024 and b'"heartbeat"' in data and _HEARTBEAT.search(data) is not None
+
+
+def classify(data: bytes) -> int:
+    '''
+    在完整解析之前, 根据原始数据判断数据帧的类型
+
+    需要扫描整个数据帧, 驱动只使用 is_heartbeat, API返回在 decode 解析后区分
+    '''
+    # 先用子串查找快速排除, 再从找到的位置确认是字段名
+    index = data.find(b'"echo"')
+    if index >= 0 and (_ECHO.match(data, index) or _ECHO.search(data, index + 1)):
+        return FRAME_ECHO
+    if is_heartbeat(data):
+        return FRAME_HEARTBEAT
+    return FRAME_EVENT
+
+
+def heartbeat_interval(data: bytes, default: int = 5000) -> int:
+    '''
+    从心跳数据帧中读取心跳间隔(毫秒), 无需完整解析
+    '''
+    ret = _INTERVAL.search(data)
+    return int(ret.group(1)) if ret else default
+
+
+def build(data: dict) -> Event:
+    '''
+    按 post_type 将事件字典转换为对应的事件对象
+    '''
+    event = EVENT_TYPES.get(data.get('post_type'), Event)(data)
+    event.setup()
+    return event
+
+
+def decode(data: bytes) -> Union[Event, dict]:
+    '''
+    解析数据帧, API返回(含 echo 字段)保持为 dict, 其余按 post_type 创建事件对象
+
+    数据帧不是合法的 JSON 对象时抛出 ValueError(含 json.JSONDecodeError 与 UnicodeDecodeError)
+    '''
+    data = json.loads(data)
+    if not isinstance(data, dict):
+        raise ValueError(f'数据帧不是 JSON 对象: {type(data).__name__}')
+    return data if 'echo' in data else build(data)
+
+
+def encode(body: dict) -> bytes:
+    return _encoder.encode(body).encode()
+
+
+__all__ = [
+    'Event',
+    'MessageEvent',
+    'NoticeEvent',
+    'RequestEvent',
+    'MetaEvent',
+    'build',
+    'classify',
+    'is_heartbeat',
+    'heartbeat_interval',
+    'decode',
+    'encode',
+    'FRAME_EVENT',
+    'FRAME_ECHO',
+    'FRAME_HEARTBEAT',
+]
@@ -0,0 +1,142 @@
+"""
+此模块提供 WebSocket 数据帧的编解码
+"""
+
+import os
+from typing import List, Tuple
+
+
+OPCODE_CONTINUATION = 0x0
+OPCODE_TEXT = 0x1
+OPCODE_BINARY = 0x2
+OPCODE_CLOSE = 0x8
+OPCODE_PING = 0x9
+OPCODE_PONG = 0xA
+
+
+class WebSocketError(Exception):
+    '''
+    WebSocket 协议错误
+    '''
+
+
+def mask(data: bytes, key: bytes) -> bytes:
+    '''
+    使用4 bytes的掩码key对数据进行掩码计算(再次计算即可还原)
+
+    将整段数据视为一个大整数与重复的key做一次异或, 避免逐字节的Python循环
+    '''
+    dataLen = len(data)
+    if not dataLen:
+        return b''
+    key = (key * (dataLen // 4 + 1))[:dataLen]
+    data = int.from_bytes(data, 'little') ^ int.from_bytes(key, 'little')
+    return data.to_bytes(dataLen, 'little')
+
+
+def encode_frame(data: bytes, opcode: int = OPCODE_TEXT) -> bytes:
+    '''
+    构造一个客户端发送的完整数据帧(带随机掩码)
+    '''
+    # FIN(1 bit): 表示该消息是否结束
+    # RSV(3*1 bit): 除扩展协议外一般为0值
+    # OPCODE(4 bit): 表数据类型
+    # Mask（1 bit): 表示是否需要进行掩码计算
+    # Payload length(7/7+16/7+64 bits): 大小视数据长度而定
+    # Masking-key(0 bit/4 bytes): 一个4 bytes大小用于掩码计算的key
+    frame = bytearray((0x80 | opcode, 0x80))
+
+    # 判断 Payload length
+    dataLen = len(data)
+    if dataLen < 126:
+        frame[1] |= dataLen
+    elif dataLen < 65536:
+        frame[1] |= 126
+        frame += dataLen.to_bytes(2, 'big')
+    else:
+        frame[1] |= 127
+        frame += dataLen.to_bytes(8, 'big')
+
+    # 每一帧使用随机的 Masking-key 进行掩码计算
+    key = os.urandom(4)
+    frame += key
+    frame += mask(data, key)
+    return bytes(frame)
+
+
+class FrameDecoder:
+    '''
+    增量式 WebSocket 数据帧解析器
+
+    通过 feed 传入任意切分的 TCP 数据, 返回其中已完整的消息 [(opcode, payload), ...]
+
+    分片消息会被重新拼接为一条, 控制帧(close/ping/pong)在收到时立即返回
+    '''
+    def __init__(self) -> None:
+        self.buffer = bytearray()   # 复用的接收缓冲区, 仅保留尚未解析完的数据
+        self.__opcode = 0
+        self.__fragments: List[bytes] = []
+
+    def feed(self, data: bytes) -> List[Tuple[int, bytes]]:
+        buf = self.buffer
+        buf += data
+
+        messages = []
+        pos, end = 0, len(buf)
+        with memoryview(buf) as view:
+            while end - pos >= 2:
+                # FIN(1 bit) + RSV(3 bit) + OPCODE(4 bit) | MASK(1 bit) + Payload length(7 bit)
+                b1, b2 = view[pos], view[pos + 1]
+                if b2 & 0x80:
+                    raise WebSocketError('服务端发送的数据帧不应进行掩码计算')
+
+                # Payload length(7/7+16/7+64 bits)
+                dataLen, offset = b2 & 0x7F, pos + 2
+                if dataLen == 126:
+                    if end - offset < 2:
+                        break
+                    dataLen = int.from_bytes(view[offset:offset + 2], 'big')
+                    offset += 2
+                elif dataLen == 127:
+                    if end - offset < 8:
+                        break
+                    dataLen = int.from_bytes(view[offset:offset + 8], 'big')
+                    offset += 8
+
+                if end - offset < dataLen:  # 数据帧尚未接收完整
+                    break
+                pos = offset + dataLen
+                self.__frame(b1 & 0x80, b1 & 0x0F, view[offset:pos].tobytes(), messages)
+
+        del buf[:pos]
+        return messages
+
+    def __frame(self, fin: int, opcode: int, payload: bytes, messages: list) -> None:
+        if opcode >= OPCODE_CLOSE:  # 控制帧可能穿插在分片之间, 不参与拼接
+            messages.append((opcode, payload))
+        elif opcode == OPCODE_CONTINUATION:
+            if not self.__fragments:
+                raise WebSocketError('收到了没有起始帧的分片')
+            self.__fragments.append(payload)
+            if fin:
+                messages.append((self.__opcode, b''.join(self.__fragments)))
+                self.__fragments.clear()
+        elif fin:
+            messages.append((opcode, payload))
+        else:   # 分片消息的起始帧
+            self.__opcode = opcode
+            self.__fragments.append(payload)
+
+
+__all__ = [
+    'mask',
+    'encode_frame',
+    'FrameDecoder',
+    'WebSocketError',
+    'OPCODE_CONTINUATION',
+    'OPCODE_TEXT',
+    'OPCODE_BINARY',
+    'OPCODE_CLOSE',
+    'OPCODE_PING',
+    'OPCODE_PONG',
+]
@@ -0,0 +1,372 @@
+"""
+此模块提供插件目录的发现、延迟加载与热重载
+
+首次加载某个插件模块时会将其导入, 并把注册的插件的触发条件记录在插件目录下的清单文件中;
+之后启动时, 文件未变化的模块只根据清单创建占位插件, 直到首次成为候选插件时才真正导入
+
+watch_plugins 定期检查已加载的插件目录, 重新导入发生变化的模块并替换其插件, 无需断开连接
+"""
+
+import os
+import re
+import sys
+import json
+import asyncio
+import importlib
+import threading
+import importlib.util
+from .logger import logger
+from .plugin import Plugin, PluginPool, PluginTable, capture
+from typing import Dict, List, Set, Tuple
+
+
+MANIFEST = '.trybot_manifest.json'
+MANIFEST_VERSION = 1
+
+_lock = threading.RLock()
+_stubs: Dict[str, List[type]] = {}  # 模块名 -> 尚未导入的占位插件(按注册顺序)
+_modules: Dict[str, List[type]] = {}    # 模块名 -> 当前版本的插件(含占位插件)
+_signatures: Dict[str, list] = {}   # 模块名 -> 最近一次加载时的文件签名(含导入失败的模块)
+_bases: Dict[str, str] = {}     # 模块名 -> 所在的插件目录
+_loaded: Dict[str, dict] = {}   # 已加载的插件目录 -> {path, manifest, entries}, fork 出的工作进程会继承而无需重复加载
+
+
+class LazyPlugin(Plugin):
+    '''
+    延迟导入的插件占位, 具有与实际插件相同的名称、优先级与触发条件
+
+    首次处理事件时在线程池中导入所属模块, 之后交由实际的插件处理, 并在 PluginPool 中替换为实际的插件
+    '''
+    module: str = None
+    real: type = None
+    rules = ()
+    is_async = False
+
+    async def start_handle(self) -> bool:
+        cls = type(self)
+        if cls.real is None:
+            await asyncio.get_running_loop().run_in_executor(None, _import, cls.module)
+            _swap(cls.module)
+            if cls.real is None:
+                return False
+        return await cls.real(self.session).start_handle()
+
+
+def _dump_trigger(trigger: tuple) -> list:
+    if trigger is None:
+        return None
+    kind, values = trigger
+    return [kind, [v if isinstance(v, str) else [v.pattern, v.flags] for v in values]]
+
+
+def _load_trigger(data: list) -> tuple:
+    if data is None:
+        return None
+    kind, values = data
+    return (kind, [v if isinstance(v, str) else re.compile(v[0], v[1]) for v in values])
+
+
+def _describe(plugin: type) -> dict:
+    return {
+        'name': plugin.__name__,
+        'priority': plugin.priority,
+        'block': plugin.block,
+        'wait_timeout': plugin.wait_timeout,
+        'trigger': _dump_trigger(plugin.trigger),
+    }
+
+
+def _signature(path: str) -> list:
+    '''
+    模块文件(包则为其中全部 .py 文件)的最后修改时间与总大小
+    '''
+    files = [path]
+    if os.path.isdir(path):
+        files = [os.path.join(root, name) for root, _, names in os.walk(path) for name in names if name.endswith('.py')]
+    stats = [os.stat(file) for file in files]
+    return [max((s.st_mtime_ns for s in stats), default=0), sum(s.st_size for s in stats)]
+
+
+def discover(path: str) -> Tuple[str, List[Tuple[str, str]]]:
+    '''
+    查找插件目录或插件包下的全部模块(忽略以 _ 或 . 开头的文件), 返回 (目录, [(模块名, 文件或包的路径), ...])
+
+    : param path: 插件目录的路径或插件包的模块名; 目录本身是包(含 __init__.py)时其模块以包名导入
+    '''
+    if os.path.isdir(path):
+        base = os.path.abspath(path)
+        if os.path.isfile(os.path.join(base, '__init__.py')):
+            parent, prefix = os.path.dirname(base), os.path.basename(base) + '.'
+        else:
+            parent, prefix = base, ''
+        if parent not in sys.path:
+            sys.path.insert(0, parent)
+    else:
+        spec = importlib.util.find_spec(path)
+        if spec is None or not spec.submodule_search_locations:
+            raise ImportError(f'{path} 不是插件目录或插件包')
+        base, prefix = list(spec.submodule_search_locations)[0], path + '.'
+
+    modules = []
+    for name in sorted(os.listdir(base)):
+        if name.startswith(('_', '.')):
+            continue
+        file = os.path.join(base, name)
+        if name.endswith('.py') and os.path.isfile(file):
+            modules.append((prefix + name[:-3], file))
+        elif os.path.isfile(os.path.join(file, '__init__.py')):
+            modules.append((prefix + name, file))
+    return base, modules
+
+
+def _execute(module: str) -> List[type]:
+    '''
+    导入插件模块并返回其注册的插件
+    '''
+    with capture() as plugins:
+        if module in sys.modules:   # 已被其它模块导入过, 重新执行以注册插件
+            if hasattr(sys.modules[module], '__path__'):
+                # 包的子模块不会随 __init__ 重新执行, 按导入顺序的逆序先行重新执行: 子模块先于父模块, 被依赖的模块通常先于依赖它的模块
+                prefix = module + '.'
+                for name in reversed([name for name in sys.modules if name.startswith(prefix)]):
+                    if sys.modules.get(name) is not None:
+                        importlib.reload(sys.modules[name])
+            importlib.reload(sys.modules[module])
+        else:
+            importlib.import_module(module)
+    return plugins
+
+
+def _import(module: str) -> None:
+    '''
+    导入延迟加载的插件模块, 并将各占位插件关联到同名的实际插件
+    '''
+    with _lock:
+        stubs = _stubs.get(module)
+        if not stubs or stubs[0].real is not None:  # 已由其它事件导入
+            return
+        try:
+            plugins = _execute(module)
+        except Exception:
+            logger.exception(f'插件模块[{module}]导入失败')
+            return
+
+        names = {plugin.__name__: plugin for plugin in plugins}
+        for index, stub in enumerate(stubs):
+            real = plugins[index] if index < len(plugins) and plugins[index].__name__ == stub.__name__ else None
+            stub.real = real or names.get(stub.__name__)
+            if stub.real is None:
+                logger.warning(f'插件模块[{module}]中已不存在插件[{stub.__name__}], 请删除清单文件后重新启动')
+
+
+def _swap(module: str) -> None:
+    '''
+    在 PluginPool 中将模块的占位插件替换为实际的插件, 须在事件循环线程内调用
+    '''
+    with _lock:
+        stubs = _stubs.pop(module, None)
+    if not stubs:
+        return
+    if _modules.get(module) == stubs:
+        _modules[module] = [stub.real for stub in stubs if stub.real]
+    stubs = set(stubs)
+    PluginPool[:] = [plugin.real if plugin in stubs else plugin for plugin in PluginPool if plugin not in stubs or plugin.real]
+    PluginTable.refresh()
+
+
+def _save(base: str) -> None:
+    info = _loaded[base]
+    try:
+        with open(info['manifest'], 'w', encoding='utf-8') as f:
+            json.dump({'version': MANIFEST_VERSION, 'modules': info['entries']}, f, ensure_ascii=False, indent=1)
+    except OSError as e:
+        logger.warning(f'写入插件清单[{info["manifest"]}]失败: {e}')
+
+
+def load_plugins(path: str, lazy: bool = True, manifest: str = None) -> List[type]:
+    '''
+    加载插件目录或插件包下的全部插件模块, 全部插件加入 PluginPool 后只排序与建立索引一次
+
+    : param path: 插件目录的路径或插件包的模块名
+
+    : param lazy: 是否延迟导入清单中已记录且文件未变化的模块
+
+    : param manifest: 清单文件的路径, 默认为插件目录下的 .trybot_manifest.json
+
+    清单根据文件的修改时间与大小判断模块是否变化, 触发条件依赖运行时配置的插件请使用 lazy=False
+
+    同一目录只会加载一次
+
+    : return: 本次加载的插件(含占位插件)
+    '''
+    with _lock:
+        base, modules = discover(path)
+        if base in _loaded:
+            return []
+        manifest = manifest or os.path.join(base, MANIFEST)
+        try:
+            with open(manifest, encoding='utf-8') as f:
+                cache = json.load(f)
+            cache = cache['modules'] if cache.get('version') == MANIFEST_VERSION else {}
+        except (OSError, ValueError, KeyError, AttributeError):
+            cache = {}
+
+        entries, added, deferred = {}, [], 0
+        for module, file in modules:
+            signature = _signatures[module] = _signature(file)
+            _bases[module] = base
+            entry = cache.get(module)
+            if lazy and entry and entry['signature'] == signature and module not in sys.modules:
+                stubs = [type(d['name'], (LazyPlugin, ), {
+                    'module': module,
+                    'priority': d['priority'],
+                    'block': d['block'],
+                    'wait_timeout': d['wait_timeout'],
+                    'trigger': _load_trigger(d['trigger']),
+                }) for d in entry['plugins']]
+                _stubs[module] = _modules[module] = stubs
+                added += stubs
+                deferred += len(stubs)
+            elif module in sys.modules:
+                logger.warning(f'插件模块[{module}]已被导入, 跳过加载')
+                continue
+            else:
+                try:
+                    plugins = _execute(module)
+                except Exception:
+                    logger.exception(f'插件模块[{module}]导入失败')
+                    continue
+                entry = {'signature': signature, 'plugins': [_describe(p) for p in plugins]}
+                _modules[module] = plugins
+                added += plugins
+            entries[module] = entry
+
+        _loaded[base] = {'path': path, 'manifest': manifest, 'entries': entries}
+        if entries != cache:
+            _save(base)
+
+        PluginPool.extend(added)
+        PluginTable.refresh()
+
+    logger.info(
+        f'从[{path}]加载{len(entries)}个插件模块, 共{len(added)}组插件(延迟导入{deferred}组), 当前共计{len(PluginPool)}组插件'
+    )
+    return added
+
+
+def _replace(module: str, plugins: List[type]) -> Set[type]:
+    '''
+    以一次赋值将模块的旧版本插件替换为 plugins, 返回旧版本的插件(含占位插件对应的实际插件), 须在事件循环线程内调用
+    '''
+    with _lock:
+        _stubs.pop(module, None)
+    old = set(_modules.pop(module, ()))
+    old |= {plugin.real for plugin in old if issubclass(plugin, LazyPlugin) and plugin.real}
+    if plugins:
+        _modules[module] = plugins
+    PluginPool[:] = [plugin for plugin in PluginPool if plugin not in old] + plugins
+    PluginTable.refresh()
+    return old
+
+
+def _drain(old: Set[type], drivers: list, drain_timeout: float = None) -> None:
+    '''
+    旧版本插件发起的会话等待继续由旧版本处理直至结束, drain_timeout 不为 None 时在该秒数后提前结束
+    '''
+    waiters = [driver.waiter for driver in drivers]
+    pending = sum(len(waiter.owned(old)) for waiter in waiters)
+    if not pending:
+        return
+    logger.info(f'旧版本插件仍有{pending}个会话在等待输入, 将继续由旧版本处理')
+    if drain_timeout is not None:
+        def expire():
+            count = sum(waiter.expire(waiter.owned(old)) for waiter in waiters)
+            if count:
+                logger.info(f'已结束旧版本插件的{count}个会话等待')
+        asyncio.get_running_loop().call_later(drain_timeout, expire)
+
+
+def _reexecute(module: str) -> List[type]:
+    with _lock:
+        return _execute(module)
+
+
+def _scan(base: str) -> Tuple[list, list]:
+    '''
+    返回插件目录中 [(变化或新增的模块, 文件签名)] 与 [已删除的模块]
+    '''
+    info = _loaded[base]
+    _, modules = discover(info['path'])
+    changed = []
+    for module, file in modules:
+        try:
+            signature = _signature(file)
+        except OSError:     # 文件正在被替换
+            continue
+        if _signatures.get(module) != signature:
+            changed.append((module, signature))
+    present = {module for module, _ in modules}
+    removed = [module for module in info['entries'] if module not in present]
+    return changed, removed
+
+
+async def reload_module(module: str, drivers: list = (), drain_timeout: float = None) -> bool:
+    '''
+    重新导入插件模块并替换其插件, 导入失败时继续使用旧版本
+
+    插件包会连同其已导入的子模块一起重新执行(见 _execute)
+
+    : param module: 由 load_plugins 加载的模块名
+
+    : param drivers: 需要处理旧版本会话等待的连接
+
+    : param drain_timeout: 旧版本插件的会话等待最多保留的秒数, 为 None 时直至其自然结束
+    '''
+    loop = asyncio.get_running_loop()
+    try:
+        plugins = await loop.run_in_executor(None, _reexecute, module)
+    except Exception:
+        logger.exception(f'重新加载插件模块[{module}]失败, 继续使用旧版本')
+        return False
+
+    action = '重新加载' if module in _modules else '加载'
+    _drain(_replace(module, plugins), drivers, drain_timeout)
+    base = _bases.get(module)
+    if base in _loaded:
+        _loaded[base]['entries'][module] = {'signature': _signatures.get(module), 'plugins': [_describe(p) for p in plugins]}
+        _save(base)
+    logger.info(f'插件模块[{module}]已{action}, 共{len(plugins)}组插件, 当前共计{len(PluginPool)}组插件')
+    return True
+
+
+async def watch_plugins(drivers: list = (), interval: float = 1, drain_timeout: float = None) -> None:
+    '''
+    每隔 interval 秒检查由 load_plugins 加载的插件目录(按文件修改时间与大小),
+    重新加载发生变化的模块、加载新增的模块、移除已删除模块的插件
+
+    : param drivers: 需要处理旧版本会话等待的连接(使用其 waiter)
+
+    : param drain_timeout: 旧版本插件的会话等待最多保留的秒数, 为 None 时直至其自然结束
+    '''
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(interval)
+        for base in list(_loaded):
+            try:
+                changed, removed = await loop.run_in_executor(None, _scan, base)
+                for module, signature in changed:
+                    _signatures[module] = signature
+                    _bases[module] = base
+                    await reload_module(module, drivers, drain_timeout)
+                for module in removed:
+                    _drain(_replace(module, []), drivers, drain_timeout)
+                    del _loaded[base]['entries'][module]
+                    _signatures.pop(module, None)
+                    _bases.pop(module, None)
+                    _save(base)
+                    logger.info(f'插件模块[{module}]已删除, 当前共计{len(PluginPool)}组插件')
+            except Exception:
+                logger.exception(f'检查插件目录[{base}]失败')
+
+
+__all__ = ['load_plugins', 'discover', 'reload_module', 'watch_plugins', 'LazyPlugin']
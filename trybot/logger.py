@@ -2,7 +2,12 @@
 此模块提供 trybot 日志的输出
 """
 import sys
+import json
+import queue
+import atexit
+import random
 import logging
+import logging.handlers
 
 
 logging.basicConfig(
@@ -14,4 +19,114 @@ logging.basicConfig(
 
 logger = logging.getLogger('Trybot')
 
-__all__ = ['logger']
\ No newline at end of file
+# 逐条事件与API调用的日志, 可单独调整级别或采样, 例如 event_logger.setLevel(logging.WARNING)
+event_logger = logging.getLogger('Trybot.event')
+
+
+class BoundedQueueHandler(logging.handlers.QueueHandler):
+    '''
+    将日志记录放入有界队列, 由 QueueListener 在后台线程格式化并输出
+
+    队列已满时直接丢弃记录并计数, 不会阻塞调用方; 记录的 % 格式化也推迟到后台线程进行
+    '''
+    def __init__(self, maxsize: int = 10000) -> None:
+        super().__init__(queue.Queue(maxsize))
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record   # 同一进程内的队列无需预先格式化与序列化
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class SampleFilter(logging.Filter):
+    '''
+    按比例 rate(0~1) 随机保留低于 level 级别的日志记录, 不低于 level 的记录总是保留
+    '''
+    def __init__(self, rate: float, level: int = logging.WARNING) -> None:
+        super().__init__()
+        self.rate = rate
+        self.level = level
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno >= self.level or random.random() < self.rate
+
+
+class JsonFormatter(logging.Formatter):
+    '''
+    将日志记录格式化为单行 JSON
+    '''
+    def format(self, record: logging.LogRecord) -> str:
+        body = {
+            'time': record.created,
+            'level': record.levelname,
+            'name': record.name,
+            'message': record.getMessage(),
+        }
+        if record.exc_info:
+            body['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(body, ensure_ascii=False, default=str)
+
+
+listener: logging.handlers.QueueListener = None
+
+
+def setup_logging(queue_size: int = 10000, level: int = logging.INFO, event_level: int = None,
+                  sample: float = 1, json_lines: bool = False, stream=sys.stdout) -> BoundedQueueHandler:
+    '''
+    切换为经由有界队列的非阻塞日志输出, 日志的格式化与写入由后台线程完成
+
+    : param queue_size: 队列长度上限, 超出的日志记录会被丢弃(计数见返回值的 dropped 属性)
+
+    : param level: trybot 日志的级别
+
+    : param event_level: 逐条事件与API调用日志的级别, 为 None 时与 level 相同
+
+    : param sample: 逐条事件与API调用日志中 INFO 及以下级别的保留比例(0~1)
+
+    : param json_lines: 是否以单行 JSON 格式输出
+
+    : param stream: 日志的输出流
+
+    '''
+    global listener
+    if listener:
+        listener.stop()
+
+    output = logging.StreamHandler(stream)
+    if json_lines:
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(logging.Formatter(
+            '[%(name)s %(asctime)s] %(levelname)s: %(message)s', "%Y/%m/%d-%H:%M:%S"
+        ))
+
+    handler = BoundedQueueHandler(queue_size)
+    root = logging.getLogger()
+    for old in root.handlers[:]:
+        root.removeHandler(old)
+    root.addHandler(handler)
+
+    logger.setLevel(level)
+    event_logger.setLevel(level if event_level is None else event_level)
+    for old in event_logger.filters[:]:
+        event_logger.removeFilter(old)
+    if sample < 1:
+        event_logger.addFilter(SampleFilter(sample))
+
+    listener = logging.handlers.QueueListener(handler.queue, output)
+    listener.start()
+    return handler
+
+
+@atexit.register
+def _stop_listener() -> None:
+    if listener:
+        listener.stop()     # 退出前输出队列中剩余的日志
+
+
+__all__ = ['logger', 'event_logger', 'setup_logging', 'BoundedQueueHandler', 'SampleFilter', 'JsonFormatter']
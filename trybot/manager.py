@@ -0,0 +1,47 @@
+"""
+此模块提供多个 OneBot 连接(多账号)的管理
+"""
+
+import asyncio
+from .driver import BotDriver
+from .scheduler import Scheduler
+from typing import Dict, List
+
+
+class DriverManager:
+    '''
+    在同一事件循环内管理多个 BotDriver 连接
+
+    各连接共用同一个调度器与插件索引, 事件按 self_id 路由回其所属的连接
+    '''
+    def __init__(self) -> None:
+        self.drivers: List[BotDriver] = []
+        self.__routes: Dict[int, BotDriver] = {}
+
+    def add(self, host: str, port: int) -> BotDriver:
+        driver = BotDriver(host, port)
+        self.drivers.append(driver)
+        return driver
+
+    def route(self, event: dict) -> BotDriver:
+        '''
+        获取事件所属账号的连接
+        '''
+        self_id = event.get('self_id')
+        driver = self.__routes.get(self_id)
+        if driver is None or driver.self_id != self_id:    # 重连后账号可能已更换连接
+            for driver in self.drivers:
+                if driver.self_id == self_id:
+                    self.__routes[self_id] = driver
+                    break
+            else:
+                return self.drivers[0] if self.drivers else None
+        return driver
+
+    async def run(self, scheduler: Scheduler, event_printer=print):
+        await asyncio.gather(*(
+            driver.run(scheduler, event_printer) for driver in self.drivers
+        ))
+
+
+__all__ = ['DriverManager']
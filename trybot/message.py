@@ -2,6 +2,8 @@
 此模块封装了适配 Go-cqhttp 的 OneBot 消息
 """
 
+from typing import List
+
 def text(text: str) -> dict:
     # https://docs.go-cqhttp.org/cqcode/#%E7%BA%AF%E6%96%87%E6%9C%AC
     return {"type": "text", "data": {"text": text}}
@@ -65,3 +67,80 @@ def tts(text: str) -> dict:
 def customnode(name: str, uin: int, content) -> dict:
     # https://docs.go-cqhttp.org/cqcode/#%E5%90%88%E5%B9%B6%E8%BD%AC%E5%8F%91%E6%B6%88%E6%81%AF%E8%8A%82%E7%82%B9
     return {"type": "node", "data": {"name": name, "uin": uin, "content": content}}
+
+
+def escape(text: str, comma: bool = False) -> str:
+    # https://docs.go-cqhttp.org/cqcode/#%E8%BD%AC%E4%B9%89
+    text = text.replace('&', '&amp;').replace('[', '&#91;').replace(']', '&#93;')
+    return text.replace(',', '&#44;') if comma else text
+
+
+def unescape(text: str) -> str:
+    if '&' not in text:
+        return text
+    return text.replace('&#44;', ',').replace('&#91;', '[').replace('&#93;', ']').replace('&amp;', '&')
+
+
+class Message(list):
+    '''
+    消息段列表, 由 parse 从 CQ 码字符串或数组格式的消息得到, str() 可转换回 CQ 码字符串
+    '''
+    def plain_text(self) -> str:
+        '''
+        纯文本内容
+        '''
+        return ''.join(seg['data'].get('text', '') for seg in self if seg['type'] == 'text').strip()
+
+    def at(self) -> List[str]:
+        '''
+        被@的 QQ 号(字符串), @全体成员时为 'all'
+        '''
+        return [str(seg['data']['qq']) for seg in self if seg['type'] == 'at']
+
+    def images(self) -> List[str]:
+        '''
+        图片的链接, 没有链接时为文件名
+        '''
+        return [seg['data'].get('url') or seg['data'].get('file', '') for seg in self if seg['type'] == 'image']
+
+    def __str__(self) -> str:
+        return ''.join(
+            escape(seg['data']['text']) if seg['type'] == 'text' else
+            '[CQ:%s]' % ','.join([seg['type']] + [
+                '%s=%s' % (k, escape(str(v), comma=True)) for k, v in seg['data'].items()
+            ])
+            for seg in self
+        )
+
+
+def parse(message) -> Message:
+    '''
+    将 CQ 码字符串、数组格式的消息或单个消息段(如 image('a.png') 的返回)解析为消息段列表(单次扫描)
+    '''
+    if isinstance(message, dict):
+        return Message([message])
+    if not isinstance(message, str):
+        return Message(message)
+
+    segments = Message()
+    pos = 0
+    while True:
+        start = message.find('[CQ:', pos)
+        end = message.find(']', start) if start >= 0 else -1
+        if end < 0:
+            break
+
+        if start > pos:
+            segments.append(text(unescape(message[pos:start])))
+
+        kind, *params = message[start + 4:end].split(',')
+        data = {}
+        for param in params:
+            key, _, value = param.partition('=')
+            data[key] = unescape(value)
+        segments.append({"type": kind, "data": data})
+        pos = end + 1
+
+    if pos < len(message):
+        segments.append(text(unescape(message[pos:])))
+    return segments
@@ -0,0 +1,236 @@
+"""
+此模块提供 trybot 运行指标的统计与导出
+"""
+
+import time
+import asyncio
+from bisect import bisect_left
+from .logger import logger
+from typing import Callable, Dict, List, Tuple
+
+
+# 默认的耗时分桶(秒)
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _labels(names: Tuple[str, ...], values: tuple, extra: str = '') -> str:
+    pairs = ['%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"')) for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{%s}' % ','.join(pairs) if pairs else ''
+
+
+class Counter:
+    '''
+    只增不减的计数, 按标签值分别计数
+    '''
+    kind = 'counter'
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values: Dict[tuple, float] = {}
+
+    def inc(self, *labels, value: float = 1) -> None:
+        self.values[labels] = self.values.get(labels, 0) + value
+
+    def render(self) -> List[str]:
+        return ['%s%s %s' % (self.name, _labels(self.labels, key), value) for key, value in self.values.items()]
+
+
+class Gauge(Counter):
+    '''
+    可任意设置的当前值, 一般在导出前由 Registry.on_collect 注册的函数更新
+    '''
+    kind = 'gauge'
+
+    def set(self, value: float, *labels) -> None:
+        self.values[labels] = value
+
+
+class Histogram:
+    '''
+    按分桶统计的耗时分布, 同时记录总和与次数
+    '''
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = BUCKETS) -> None:
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.values: Dict[tuple, list] = {}  # labels -> [各分桶次数..., 总和, 次数]
+
+    def observe(self, value: float, *labels) -> None:
+        data = self.values.get(labels)
+        if data is None:
+            data = self.values[labels] = [0] * (len(self.buckets) + 2)
+        index = bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            data[index] += 1
+        data[-2] += value
+        data[-1] += 1
+
+    def time(self, *labels) -> '_Timer':
+        '''
+        with histogram.time(label): ... 统计代码块的耗时
+        '''
+        return _Timer(self, labels)
+
+    def quantile(self, q: float, *labels) -> float:
+        '''
+        由分桶估计分位数(取所在分桶的上界), 超出最大分桶时返回 inf
+        '''
+        data = self.values.get(labels)
+        if not data or not data[-1]:
+            return 0
+        rank, total = q * data[-1], 0
+        for bound, count in zip(self.buckets, data):
+            total += count
+            if total >= rank:
+                return bound
+        return float('inf')
+
+    def render(self) -> List[str]:
+        lines = []
+        for key, data in self.values.items():
+            total = 0
+            for bound, count in zip(self.buckets, data):
+                total += count
+                lines.append('%s_bucket%s %d' % (self.name, _labels(self.labels, key, 'le="%s"' % bound), total))
+            lines.append('%s_bucket%s %d' % (self.name, _labels(self.labels, key, 'le="+Inf"'), data[-1]))
+            lines.append('%s_sum%s %s' % (self.name, _labels(self.labels, key), data[-2]))
+            lines.append('%s_count%s %d' % (self.name, _labels(self.labels, key), data[-1]))
+        return lines
+
+
+class _Timer:
+    __slots__ = ('histogram', 'labels', 'start')
+
+    def __init__(self, histogram: Histogram, labels: tuple) -> None:
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+
+
+class Registry(dict):
+    '''
+    指标表, 以指标名称为键
+
+    所有指标均在事件循环线程内更新与导出, 无需加锁
+    '''
+    def __init__(self) -> None:
+        super().__init__()
+        self.collectors: List[Callable[[], None]] = []
+
+    def __get(self, cls, name: str, help: str, labels: Tuple[str, ...], **kwargs):
+        metric = self.get(name)
+        if metric is None:
+            metric = self[name] = cls(name, help, labels, **kwargs)
+        return metric
+
+    def counter(self, name: str, help: str, labels: Tuple[str, ...] = ()) -> Counter:
+        return self.__get(Counter, name, help, labels)
+
+    def gauge(self, name: str, help: str, labels: Tuple[str, ...] = ()) -> Gauge:
+        return self.__get(Gauge, name, help, labels)
+
+    def histogram(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = BUCKETS) -> Histogram:
+        return self.__get(Histogram, name, help, labels, buckets=buckets)
+
+    def on_collect(self, func: Callable[[], None]) -> Callable[[], None]:
+        '''
+        注册在导出前调用的函数, 用于更新队列深度等 Gauge
+        '''
+        self.collectors.append(func)
+        return func
+
+    def collect(self) -> None:
+        for func in self.collectors:
+            try:
+                func()
+            except Exception:
+                logger.exception('更新运行指标失败')
+
+    def render(self) -> str:
+        '''
+        导出为 Prometheus 文本格式
+        '''
+        self.collect()
+        lines = []
+        for metric in self.values():
+            lines.append('# HELP %s %s' % (metric.name, metric.help))
+            lines.append('# TYPE %s %s' % (metric.name, metric.kind))
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def summary(self) -> str:
+        '''
+        生成便于阅读的单行摘要: 计数与当前值, 以及各耗时分布的次数与 p50/p99
+        '''
+        self.collect()
+        parts = []
+        for metric in self.values():
+            for key, value in metric.values.items():
+                name = metric.name + (_labels(metric.labels, key))
+                if isinstance(metric, Histogram):
+                    parts.append('%s count=%d p50=%s p99=%s' % (
+                        name, value[-1], metric.quantile(0.5, *key), metric.quantile(0.99, *key)
+                    ))
+                else:
+                    parts.append('%s=%s' % (name, value))
+        return '; '.join(parts)
+
+
+metrics = Registry()
+
+EVENTS = metrics.counter('trybot_events_total', '收到的事件数', ('type',))
+PLUGIN_MATCH = metrics.histogram('trybot_plugin_match_seconds', '插件匹配耗时(不含等待会话输入)', ('plugin',))
+PLUGIN_HANDLE = metrics.histogram('trybot_plugin_handle_seconds', '插件处理耗时', ('plugin',))
+PLUGIN_ERRORS = metrics.counter('trybot_plugin_errors_total', '插件处理时抛出的异常数', ('plugin',))
+API_RTT = metrics.histogram('trybot_api_seconds', 'API调用从发出到返回的耗时', ('action',))
+API_TIMEOUTS = metrics.counter('trybot_api_timeouts_total', 'API调用超时数', ('action',))
+QUEUE_DEPTH = metrics.gauge('trybot_queue_depth', '各队列的当前深度', ('queue', 'bot'))
+
+
+async def serve_metrics(host: str = '127.0.0.1', port: int = 9100) -> asyncio.AbstractServer:
+    '''
+    在本地启动 HTTP 服务, 以 Prometheus 文本格式导出运行指标(任意路径均返回指标)
+    '''
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), 10)
+            body = metrics.render().encode()
+            writer.write(
+                b'HTTP/1.1 200 OK\r\n'
+                b'Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n'
+                b'Content-Length: %d\r\nConnection: close\r\n\r\n' % len(body) + body
+            )
+            await writer.drain()
+        except (OSError, EOFError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    logger.info(f'运行指标导出于 http://{host}:{port}/metrics')
+    return server
+
+
+async def log_metrics(interval: float = 60) -> None:
+    '''
+    每隔 interval 秒将运行指标的摘要写入日志
+    '''
+    while True:
+        await asyncio.sleep(interval)
+        logger.info('运行指标: %s', metrics.summary())
+
+
+__all__ = ['metrics', 'Registry', 'Counter', 'Gauge', 'Histogram', 'serve_metrics', 'log_metrics']
@@ -3,15 +3,29 @@
 """
 
 
+import time
+import asyncio
 from .logger import logger
-from .session import Session
-from re import findall
-from typing import List, Callable, Generator
+from .dispatch import PluginIndex
+from .scheduler import idle
+from .metrics import PLUGIN_MATCH, PLUGIN_HANDLE, PLUGIN_ERRORS
+from .session import Session, AsyncSession
+import re
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List, Tuple, Callable, Generator, Pattern, Union
 
 
 class Plugin:
+    # 同步处理函数所使用的线程池, 为 None 时使用事件循环的默认线程池
+    executor: ThreadPoolExecutor = None
+    # 处理函数的 模块名.限定名, 用作 session.state 的命名空间, 重新加载后保持不变
+    namespace: str = ''
+
     def __init__(self, session: Session) -> None:
         self.session = session
+        session.plugin = self.namespace
+        self.waited = 0     # 匹配过程中等待会话输入的时间(秒), 不计入匹配耗时
 
     async def match(self) -> bool:
         for rule in self.rules:
@@ -22,21 +36,63 @@ class Plugin:
                 return False
             elif uid is True:
                 continue
-            elif await self.session.driver.waiter.wait(uid, ret):
-                return False
+            else:
+                waiter = self.session.driver.waiter
+                start = time.perf_counter()
+                with idle():    # 等待期间不占用调度器的并发名额
+                    timeout = await waiter.wait(waiter.key(self.session.event, uid), ret, self.wait_timeout, type(self), self.session)
+                self.waited += time.perf_counter() - start
+                if timeout:
+                    return False
         return True
 
+    async def handle(self) -> None:
+        if self.is_async:
+            await self.handler(AsyncSession(self.session))
+        else:   # 同步的处理函数交由线程池执行, 避免阻塞事件循环
+            await asyncio.get_running_loop().run_in_executor(
+                self.executor, self.handler, self.session
+            )
+
     async def start_handle(self) -> bool:
-        if await self.match():
-            self.handle()
-            return True
-        return False
+        name = self.namespace or type(self).__name__    # 以 模块名.限定名 区分不同模块中的同名插件
+        start = time.perf_counter()
+        matched = await self.match()
+        PLUGIN_MATCH.observe(time.perf_counter() - start - self.waited, name)
+        if not matched:
+            return False
+
+        start = time.perf_counter()
+        try:
+            await self.handle()
+        except Exception:
+            PLUGIN_ERRORS.inc(name)
+            raise
+        finally:
+            PLUGIN_HANDLE.observe(time.perf_counter() - start, name)
+        return True
 
 
 PluginPool: List[Plugin] = []
+PluginTable = PluginIndex(PluginPool)
+
+_captured: List[type] = None    # 不为 None 时, 注册的插件暂存于此而不加入 PluginPool
+
+
+@contextmanager
+def capture() -> Iterator[List[type]]:
+    '''
+    暂存期间注册的插件而不加入 PluginPool, 供 loader 导入插件模块时使用
+    '''
+    global _captured
+    previous, _captured = _captured, []
+    try:
+        yield _captured
+    finally:
+        _captured = previous
 
 
-def on_event(*rules: Callable[[Session], Generator], priority: int = 10, block: bool = False):
+def on_event(*rules: Callable[[Session], Generator], priority: int = 10, block: bool = False, wait_timeout: float = 30, trigger: Tuple[str, List[str]] = None):
     '''
     事件触发器
 
@@ -45,16 +101,32 @@ def on_event(*rules: Callable[[Session], Generator], priority: int = 10, block:
     : param priority: 插件优先级(数值越小级别越高)
 
     : param block: 当前插件处理成功后是否阻断后续插件执行
+
+    : param wait_timeout: 等待会话输入的超时时间(秒)
+
+    : param trigger: 供插件索引使用的触发条件, 如 ('full', ['复读']), 一般由 on_full 等触发器填写
+
+    被装饰的函数为 async def 时在事件循环内等待执行, 并接收 AsyncSession;
+    否则交由线程池执行, 接收 Session
     '''
     def wrapper(func: Callable[[Session], None]):
         name = func.__name__.title()
-        PluginPool.append(type(name, (Plugin, ), {
+        plugin = type(name, (Plugin, ), {
             'block': block,
             'rules': rules,
+            'trigger': trigger,
             'priority': priority,
-            'handle': lambda p: func(p.session)
-        }))
-        PluginPool.sort(key=lambda p: p.priority)
+            'wait_timeout': wait_timeout,
+            'handler': staticmethod(func),
+            'namespace': f'{func.__module__}.{func.__qualname__}',
+            'is_async': asyncio.iscoroutinefunction(func)
+        })
+        if _captured is not None:
+            _captured.append(plugin)
+            return
+
+        PluginPool.append(plugin)
+        PluginTable.refresh()   # 按优先级排序推迟到重建索引时统一进行
 
         logger.info(f'插件[{name}]已导入，当前共计{len(PluginPool)}组插件')
 
@@ -75,18 +147,20 @@ def on_full(keyword: str, *rules: Callable[[Session], Generator], mustGiven: str
 
     : param block: 当前插件处理成功后是否阻断后续插件执行
 
+    : param wait_timeout: 等待会话输入的超时时间(秒)
+
     匹配结果保留至session.matched
     
     '''
     def full_rule(session: Session):
-        if keyword == session.event['message']:
+        if keyword == session.event.text:
             if mustGiven:
                 session.send_msg(mustGiven)
-                session.matched = yield session.event['user_id']
+                session.matched = yield session.event.user_id
             else:
                 yield True
         yield False
-    return on_event(*rules, full_rule, **kwargs)
+    return on_event(*rules, full_rule, trigger=('full', [keyword]), **kwargs)
 
 
 def on_fulls(keywords: List[str], *rules: Callable[[Session], Generator], mustGiven: str = '',  **kwargs):
@@ -103,18 +177,20 @@ def on_fulls(keywords: List[str], *rules: Callable[[Session], Generator], mustGi
 
     : param block: 当前插件处理成功后是否阻断后续插件执行
 
+    : param wait_timeout: 等待会话输入的超时时间(秒)
+
     匹配结果保留至session.matched
     
     '''
     def fulls_rule(session: Session):
-        if session.event['message'] in keywords:
+        if session.event.text in keywords:
             if mustGiven:
                 session.send_msg(mustGiven)
-                session.matched = yield session.event['user_id']
+                session.matched = yield session.event.user_id
             else:
                 yield True
         yield False
-    return on_event(*rules, fulls_rule, **kwargs)
+    return on_event(*rules, fulls_rule, trigger=('full', list(keywords)), **kwargs)
 
 
 def on_command(cmd: str, *rules: Callable[[Session], Generator], mustGiven: str = '',  **kwargs):
@@ -131,18 +207,20 @@ def on_command(cmd: str, *rules: Callable[[Session], Generator], mustGiven: str
 
     : param block: 当前插件处理成功后是否阻断后续插件执行
 
+    : param wait_timeout: 等待会话输入的超时时间(秒)
+
     匹配结果保留至session.matched
     
     '''
     def cmd_rule(session: Session):
-        if session.event['message'].startswith(cmd):
-            session.matched = session.event['message'][len(cmd):].strip()
+        if session.event.text.startswith(cmd):
+            session.matched = session.event.text[len(cmd):].strip()
             if not session.matched and mustGiven:
                 session.send_msg(mustGiven)
-                session.matched = yield session.event['user_id']
+                session.matched = yield session.event.user_id
             yield bool(session.matched)
         yield False
-    return on_event(*rules, cmd_rule, **kwargs)
+    return on_event(*rules, cmd_rule, trigger=('command', [cmd]), **kwargs)
 
 
 def on_commands(cmds: List[str], *rules: Callable[[Session], Generator], mustGiven: str = '',  **kwargs):
@@ -159,28 +237,34 @@ def on_commands(cmds: List[str], *rules: Callable[[Session], Generator], mustGiv
 
     : param block: 当前插件处理成功后是否阻断后续插件执行
 
+    : param wait_timeout: 等待会话输入的超时时间(秒)
+
     匹配结果保留至session.matched
     
     '''
     def cmds_rule(session: Session):
         for cmd in cmds:
-            if session.event['message'].startswith(cmd):
-                session.matched = session.event['message'][len(cmd):].strip()
+            if session.event.text.startswith(cmd):
+                session.matched = session.event.text[len(cmd):].strip()
                 if not session.matched and mustGiven:
                     session.send_msg(mustGiven)
-                    session.matched = yield session.event['user_id']
+                    session.matched = yield session.event.user_id
                 yield bool(session.matched)
         yield False
-    return on_event(*rules, cmds_rule, **kwargs)
+    return on_event(*rules, cmds_rule, trigger=('command', list(cmds)), **kwargs)
 
-def on_regex(pattern:str, *rules: Callable[[Session], Generator],  **kwargs):
+def on_regex(pattern: Union[str, Pattern], *rules: Callable[[Session], Generator], mode: str = 'findall', flags: int = 0, **kwargs):
     '''
-    命令组匹配触发器
+    正则匹配触发器
 
-    : param pattern: 正则语句
+    : param pattern: 正则语句, 注册时即编译
 
     : param rules: 事件匹配规则集
 
+    : param mode: 匹配方式, 'findall' 时 session.matched 为全部匹配结果的列表;
+                  'search' / 'match' / 'fullmatch' 时为首个匹配的 re.Match 对象, 找到即停止而不生成列表
+
+    : param flags: 编译正则时使用的标志, 如 re.I
 
     : param priority: 插件优先级(数值越小级别越高)
 
@@ -189,8 +273,13 @@ def on_regex(pattern:str, *rules: Callable[[Session], Generator],  **kwargs):
     匹配结果保留至session.matched
     
     '''
+    if mode not in ('findall', 'search', 'match', 'fullmatch'):
+        raise ValueError(f'不支持的正则匹配方式: {mode}')
+    regex = re.compile(pattern, flags)
+    method = getattr(regex, mode)
+
     def reg_rule(session: Session):
-        session.matched = findall(pattern, session.event['message'])
-        yield bool(session.matched)
+        session.matched = method(session.event.text)
+        yield session.matched is not None and session.matched != []
     
-    return on_event(*rules, reg_rule, **kwargs)
\ No newline at end of file
+    return on_event(*rules, reg_rule, trigger=('regex', [regex]), **kwargs)
\ No newline at end of file
@@ -0,0 +1,161 @@
+"""
+此模块提供事件的调度, 在 listen 与 event_handler 之间控制事件处理的顺序与并发
+"""
+
+import asyncio
+from .logger import logger
+from .event import Event
+from functools import partial
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, Callable, Awaitable
+
+
+_current: ContextVar['Scheduler'] = ContextVar('trybot_scheduler', default=None)    # 处理当前事件的调度器
+
+
+class Scheduler:
+    '''
+    事件调度器
+
+    - 同一会话(见 Event.key)内的事件按到达顺序逐个处理
+
+    - 不同会话之间轮流取出事件并行处理, 同时处理的事件总数不超过 concurrency
+
+    - 处理中的事件等待会话输入期间(见 idle)不占用并发名额
+
+    - 会话排队的事件数达到 queue_size 时按 policy 处理:
+      'drop' 丢弃该会话最早排队的事件; 'block' 暂停读取新事件直至有空位,
+      由于API返回与事件共用同一连接, 最多阻塞 block_timeout 秒后仍会丢弃最早的事件
+
+    : param handler: 事件处理协程函数
+
+    : param concurrency: 同时处理的事件上限
+
+    : param queue_size: 每个会话排队等待的事件上限
+
+    : param policy: 队列已满时的策略, 'drop' 或 'block'
+
+    : param block_timeout: 'block' 策略下最长阻塞时间(秒)
+    '''
+    def __init__(self, handler: Callable[[Event], Awaitable], concurrency: int = 64, queue_size: int = 100,
+                 policy: str = 'drop', block_timeout: float = 5) -> None:
+        if policy not in ('drop', 'block'):
+            raise ValueError(f'未知的队列策略: {policy}')
+
+        self.handler = handler
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.policy = policy
+        self.block_timeout = block_timeout
+
+        self.active = 0     # 正在处理的事件数
+        self.waiting = 0    # 处理中但正在等待会话输入的事件数, 不计入 active
+        self.dropped = 0    # 因队列已满而丢弃的事件数
+
+        self.__queues: Dict[tuple, deque] = {}  # 有事件排队或正在处理的会话
+        self.__ready = deque()  # 等待轮到处理的会话
+        self.__running = set()  # 正在处理事件的会话
+        self.__space = asyncio.Event()
+
+    def stats(self) -> dict:
+        return {
+            'active': self.active,
+            'waiting': self.waiting,
+            'queued': sum(map(len, self.__queues.values())),
+            'conversations': len(self.__queues),
+            'dropped': self.dropped,
+        }
+
+    async def put(self, event: Event) -> None:
+        '''
+        将事件加入所属会话的队列
+        '''
+        key = event.key
+        queue = self.__queues.get(key)
+        if queue is None:
+            queue = self.__queues[key] = deque()
+
+        if len(queue) >= self.queue_size and self.policy == 'block':
+            try:
+                await asyncio.wait_for(self.__wait_space(queue), self.block_timeout)
+            except asyncio.TimeoutError:
+                pass
+            # 等待期间会话可能已处理完毕并被移除, 需重新取得其队列
+            queue = self.__queues.setdefault(key, deque())
+
+        if len(queue) >= self.queue_size:
+            queue.popleft()
+            self.dropped += 1
+            logger.warning(f'会话[{key}]排队事件已达上限{self.queue_size}, 丢弃最早的事件')
+
+        queue.append(event)
+        if key not in self.__running and len(queue) == 1:
+            self.__ready.append(key)
+        self.__pump()
+
+    async def __wait_space(self, queue: deque) -> None:
+        while len(queue) >= self.queue_size:
+            self.__space.clear()
+            await self.__space.wait()
+
+    def __pump(self) -> None:
+        while self.active < self.concurrency and self.__ready:
+            key = self.__ready.popleft()
+            event = self.__queues[key].popleft()
+
+            self.active += 1
+            self.__running.add(key)
+            task = asyncio.ensure_future(self.__run(event))
+            task.add_done_callback(partial(self.__done, key))
+        self.__space.set()
+
+    async def __run(self, event: Event) -> None:
+        _current.set(self)  # 每个任务拥有独立的上下文, 仅对本次处理生效
+        await self.handler(event)
+
+    def _park(self) -> None:
+        self.active -= 1
+        self.waiting += 1
+        self.__pump()
+
+    def _unpark(self) -> None:
+        # 恢复时不再等待空位, 处理中的事件数可能暂时超过 concurrency
+        self.waiting -= 1
+        self.active += 1
+
+    def __done(self, key: tuple, task: asyncio.Task) -> None:
+        self.active -= 1
+        self.__running.discard(key)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f'会话[{key}]事件处理异常', exc_info=task.exception())
+
+        # 仍有排队事件的会话回到队尾, 使各会话轮流得到处理
+        if self.__queues[key]:
+            self.__ready.append(key)
+        else:
+            del self.__queues[key]
+        self.__pump()
+
+
+@contextmanager
+def idle() -> Iterator[None]:
+    '''
+    在调度器处理的事件内使用, 期间让出该事件占用的并发名额, 供其它会话的事件处理
+
+    用于等待会话输入这类可能持续很久却不占用处理资源的等待; 该会话的后续事件仍需等待本次处理结束
+    '''
+    scheduler = _current.get()
+    if scheduler is None:
+        yield
+        return
+
+    scheduler._park()
+    try:
+        yield
+    finally:
+        scheduler._unpark()
+
+
+__all__ = ['Scheduler', 'idle']
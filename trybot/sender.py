@@ -0,0 +1,271 @@
+"""
+此模块提供API调用的发送队列, 对发送消息进行限速与合并
+"""
+
+import asyncio
+from .logger import logger
+from .metrics import API_TIMEOUTS
+from .message import Message, parse, text, customnode
+from collections import OrderedDict, deque
+from typing import Dict, List
+
+
+# 管理操作优先于普通的消息发送
+PRIORITY_ACTIONS = {
+    'delete_msg',
+    'set_group_kick',
+    'set_group_ban',
+    'set_group_whole_ban',
+    'set_group_anonymous_ban',
+}
+
+# 需要按发送目标限速的消息发送
+SEND_ACTIONS = {
+    'send_msg',
+    'send_group_msg',
+    'send_private_msg',
+    'send_group_forward_msg',
+}
+
+
+class TokenBucket:
+    '''
+    令牌桶: 每秒补充 rate 个令牌, 最多积攒 burst 个, rate <= 0 时不限速
+    '''
+    __slots__ = ('rate', 'burst', 'tokens', 'stamp')
+
+    def __init__(self, rate: float, burst: int, now: float) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.stamp = now
+
+    def wait_time(self, now: float) -> float:
+        '''
+        距离下一个令牌可用的时间(秒), 当前即可用时为 0
+        '''
+        if self.rate <= 0:
+            return 0
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self) -> None:
+        if self.rate > 0:
+            self.tokens -= 1
+
+
+class Sender:
+    '''
+    API调用的发送队列
+
+    - PRIORITY_ACTIONS 中的管理操作进入优先队列, 总是先于消息发送
+
+    - SEND_ACTIONS 中的消息发送按目标(群/私聊)排队, rate > 0 时每个目标以 rate/burst 令牌桶限速, 各目标轮流发送
+
+    - total_rate > 0 时优先队列与消息发送共同受 total_rate/total_burst 的账号级令牌桶限制
+
+    - 调用的 timeout 从进入队列时开始计算, 排队期间超时的调用不再发送并返回 None
+
+    - coalesce > 0 时, 同一目标在 coalesce 秒内排队的多条消息会合并为一条发送,
+      合并条数达到 forward 时(仅群聊, forward > 0)改为合并转发消息
+
+    - 其它API调用不经过队列, 直接发送
+
+    以上参数的默认值为类属性, 默认不限速也不合并, 可以通过 Sender.rate = 1 统一修改, 或修改某个连接的 driver.sender
+
+    : param driver: 实际发送调用的驱动(使用其 request 方法)
+    '''
+    rate: float = 0
+    burst: int = 5
+    total_rate: float = 0
+    total_burst: int = 10
+    coalesce: float = 0
+    forward: int = 0
+
+    def __init__(self, driver) -> None:
+        self.driver = driver
+
+        self.sent = 0       # 已发送的排队调用数(合并后计为一次)
+        self.coalesced = 0  # 被合并到其它消息中的调用数
+        self.expired = 0    # 排队期间超时而未发送的调用数
+
+        self.__priority = deque()
+        self.__targets: Dict[tuple, deque] = OrderedDict()
+        self.__buckets: Dict[tuple, TokenBucket] = {}
+        self.__total = TokenBucket(self.total_rate, self.total_burst, 0)
+        self.__wakeup: asyncio.Event = None
+        self.__task: asyncio.Task = None
+        self.__expiry = float('inf')    # 排队中的调用最早的截止时间
+
+    def stats(self) -> dict:
+        return {
+            'priority': len(self.__priority),
+            'queued': sum(map(len, self.__targets.values())),
+            'targets': len(self.__targets),
+            'sent': self.sent,
+            'coalesced': self.coalesced,
+            'expired': self.expired,
+        }
+
+    async def call(self, action: str, params: dict, timeout: float = 30) -> dict:
+        '''
+        提交API调用并等待其返回, 包括排队在内超过 timeout 秒返回 None
+        '''
+        if action in PRIORITY_ACTIONS:
+            queue = self.__priority
+        elif action in SEND_ACTIONS:
+            target = self.__target(action, params)
+            queue = self.__targets.get(target)
+            if queue is None:
+                queue = self.__targets[target] = deque()
+        else:
+            return await self.driver.request(action, params, timeout)
+
+        loop = asyncio.get_running_loop()
+        if self.__task is None or self.__task.done():
+            self.__wakeup = asyncio.Event()
+            self.__task = loop.create_task(self.__run())
+
+        now = loop.time()
+        future = loop.create_future()
+        queue.append((action, params, now + timeout, future, now))
+        self.__expiry = min(self.__expiry, now + timeout)
+        self.__wakeup.set()
+        return await future
+
+    @staticmethod
+    def __target(action: str, params: dict) -> tuple:
+        if action == 'send_private_msg' or action == 'send_msg' and params.get('message_type') == 'private':
+            return ('private', params.get('user_id'))
+        if 'group_id' in params:
+            return ('group', params['group_id'])
+        return ('private', params.get('user_id'))
+
+    async def __run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            self.__wakeup.clear()
+            wait = self.__dispatch(loop.time())
+            try:
+                await asyncio.wait_for(self.__wakeup.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+
+    def __dispatch(self, now: float) -> float:
+        # 发送当前可以发送的调用, 返回距离下一次可能发送或超时的时间(秒), 队列为空时返回 None
+        if now >= self.__expiry:
+            self.__expire(now)
+
+        while self.__priority:
+            wait = self.__total.wait_time(now)
+            if wait:
+                return min(wait, self.__expiry - now)
+            self.__total.take()
+            action, params, deadline, future, _ = self.__priority.popleft()
+            self.__post(action, params, deadline - now, [future])
+
+        wait = None
+        for target in list(self.__targets):
+            queue = self.__targets[target]
+            if not queue:   # 排队的调用均已超时
+                del self.__targets[target]
+                continue
+            bucket = self.__buckets.get(target)
+            if bucket is None:
+                bucket = self.__buckets[target] = TokenBucket(self.rate, self.burst, now)
+
+            delay = max(queue[0][4] + self.coalesce - now, bucket.wait_time(now))
+            if delay <= 0:
+                delay = self.__total.wait_time(now)
+                if delay <= 0:
+                    bucket.take()
+                    self.__total.take()
+                    self.__send(queue, now)
+                    if not queue:
+                        del self.__targets[target]
+                        continue
+                    # 已发送的目标移至末尾, 使各目标轮流发送, 并立即进行下一轮分发
+                    self.__targets.move_to_end(target)
+                    delay = 0
+            wait = delay if wait is None else min(wait, delay)
+
+        if len(self.__buckets) > 1024:  # 清理已回满且没有排队消息的令牌桶
+            for target in [t for t, b in self.__buckets.items() if t not in self.__targets and b.wait_time(now) == 0 and b.tokens >= b.burst]:
+                del self.__buckets[target]
+        if wait is not None:
+            wait = min(wait, self.__expiry - now)
+        return wait
+
+    def __expire(self, now: float) -> None:
+        # 使已到截止时间的排队调用返回 None, 并重新计算最早的截止时间
+        expiry = float('inf')
+        for queue in (self.__priority, *self.__targets.values()):
+            if not any(item[2] <= now or item[3].done() for item in queue):
+                expiry = min([expiry, *(item[2] for item in queue)])
+                continue
+
+            items = list(queue)
+            queue.clear()
+            for item in items:
+                action, _, deadline, future, _ = item
+                if future.done():   # 调用方已取消等待
+                    continue
+                if deadline <= now:
+                    self.expired += 1
+                    API_TIMEOUTS.inc(action)
+                    logger.error(f"发送API[{action}]调用 -> 在发送队列中等待超时......")
+                    future.set_result(None)
+                    continue
+                queue.append(item)
+                expiry = min(expiry, deadline)
+        self.__expiry = expiry
+
+    def __send(self, queue: deque, now: float) -> None:
+        action, params, deadline, future, _ = queue.popleft()
+        if not self.coalesce or action == 'send_group_forward_msg':
+            self.__post(action, params, deadline - now, [future])
+            return
+
+        # 合并同一目标排队中的同类消息, 使用其中最早的截止时间
+        messages, futures = [params['message']], [future]
+        while queue and queue[0][0] == action:
+            _, other, other_deadline, future, _ = queue.popleft()
+            messages.append(other['message'])
+            futures.append(future)
+            deadline = min(deadline, other_deadline)
+        self.coalesced += len(futures) - 1
+
+        params = dict(params)
+        if self.forward and len(messages) >= self.forward and 'group_id' in params and action != 'send_private_msg':
+            uin = self.driver.self_id or 0
+            action, params = 'send_group_forward_msg', {
+                'group_id': params['group_id'],
+                'messages': [customnode(str(uin), uin, list(parse(message)) if isinstance(message, dict) else message) for message in messages]
+            }
+        elif all(isinstance(message, str) for message in messages):
+            params['message'] = '\n'.join(messages)
+        else:
+            merged = Message()    # 含数组格式或单个消息段的消息, 统一解析为消息段后拼接
+            for message in messages:
+                if merged:
+                    merged.append(text('\n'))
+                merged += parse(message)
+            params['message'] = list(merged)
+        self.__post(action, params, deadline - now, futures)
+
+    def __post(self, action: str, params: dict, timeout: float, futures: List[asyncio.Future]) -> None:
+        self.sent += 1
+        task = asyncio.ensure_future(self.driver.request(action, params, timeout))
+
+        def done(task: asyncio.Task):
+            ret = None if task.cancelled() or task.exception() else task.result()
+            if not task.cancelled() and task.exception():
+                logger.error(f'发送API[{action}]调用异常', exc_info=task.exception())
+            for future in futures:
+                if not future.done():
+                    future.set_result(ret)
+        task.add_done_callback(done)
+
+
+__all__ = ['Sender', 'TokenBucket', 'PRIORITY_ACTIONS', 'SEND_ACTIONS']
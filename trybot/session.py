@@ -1,7 +1,27 @@
 """
 此模块提供 OneBot Api 的封装
 """
-from .logger import logger
+import asyncio
+from .state import State, StateStore
+from typing import Iterable, List, Tuple
+
+
+async def batch_call(driver, calls: Iterable[Tuple[str, dict]], window: int = 16, timeout: float = 30) -> List[dict]:
+    '''
+    同时发出多个API调用, 同一时刻最多有 window 个调用等待返回, 按 calls 的顺序返回各调用的结果
+
+    某个调用超时或连接断开时其结果为 None, 不影响其它调用
+    '''
+    calls = list(calls)
+    results = [None] * len(calls)
+    pending = iter(enumerate(calls))
+
+    async def worker():
+        for index, (action, params) in pending:
+            results[index] = await driver.call_action(action, params, timeout)
+
+    await asyncio.gather(*[worker() for _ in range(min(max(window, 1), len(calls)))])
+    return results
 
 
 class Session:
@@ -9,8 +29,17 @@ class Session:
         self.event = event
         self.driver = driver
         self.matched = None
+        self.reply = None   # 会话等待(如 mustGiven)收到的回复消息事件, 可从中读取图片等非文本内容
+        self.plugin = ''    # 正在处理事件的插件的命名空间(见 Plugin.namespace), 由 Plugin 设置
 
-    def call_action(self, action: str, params: dict) -> dict:
+    @property
+    def state(self) -> State:
+        '''
+        当前插件的持久化状态, 以处理函数的 模块名.限定名 为命名空间, 首次使用时打开数据库(见 StateStore)
+        '''
+        return StateStore.default().namespace(self.plugin)
+
+    def call_action(self, action: str, params: dict, timeout: float = 30) -> dict:
         '''
         详情请查阅: https://docs.go-cqhttp.org/api/
 
@@ -18,13 +47,41 @@ class Session:
 
         : param params: 提交给Api的参数
 
+        : param timeout: 等待返回的超时时间(秒), 超时返回 None
+
+        在事件循环线程内调用时不等待返回, 结果恒为 None
+
+        '''
+        coro = self.driver.call_action(action, params, timeout)
+        if self.driver.in_loop():
+            # 事件循环线程内阻塞等待会卡住监听, 此时仅发送调用而不等待返回
+            asyncio.ensure_future(coro)
+            return None
+
+        # 阻塞至响应或者超时
+        return asyncio.run_coroutine_threadsafe(coro, self.driver.loop).result()
+
+    def batch(self, calls: Iterable[Tuple[str, dict]], window: int = 16, timeout: float = 30) -> List[dict]:
         '''
-        self.driver.send({"action": action, "params": params, "echo": 123})
-        logger.info(f"发送API[{action}]调用 <- {params}")
-        try:    # 阻塞至响应或者等待30s超时
-            return self.driver.backer.get(timeout=30)
-        except:  # 等待30s超时异常捕获
-            logger.error("接收API[{action}]返回 -> 超时......")
+        批量进行Api调用, 多个调用同时发出而无需逐个等待返回, 适用于批量撤回、禁言、踢人等操作
+
+        : param calls: (action, params) 的序列, 例如 [('delete_msg', {'message_id': 1}), ...]
+
+        : param window: 同时等待返回的调用数上限
+
+        : param timeout: 每个调用等待返回的超时时间(秒)
+
+        : return: 与 calls 顺序一致的返回列表, 可由各项的 status/retcode 判断是否成功, 超时或连接断开的项为 None
+
+        批量调用同样经过发送队列的限速; 在事件循环线程内调用时不等待返回, 结果恒为 None
+
+        '''
+        coro = batch_call(self.driver, calls, window, timeout)
+        if self.driver.in_loop():
+            asyncio.ensure_future(coro)
+            return None
+
+        return asyncio.run_coroutine_threadsafe(coro, self.driver.loop).result()
 
     def send_group_msg(self, group_id: int, message) -> int:
         '''
@@ -70,10 +127,11 @@ class Session:
         : return: 消息 ID
 
         '''
-        if self.event.get('group_id', 0):
-            return self.send_group_msg(self.event['group_id'], message)
+        _, group_id, user_id = self.event.key
+        if group_id:
+            return self.send_group_msg(group_id, message)
         else:
-            return self.send_private_msg(self.event['user_id'], message)
+            return self.send_private_msg(user_id, message)
 
     def send_group_forward_msg(self, group_id: int, messages) -> None:
         '''
@@ -252,3 +310,167 @@ class Session:
                 'no_cache': no_cache
             }
         )
+
+
+class AsyncSession:
+    '''
+    Session 的异步版本, 供 async def 定义的插件处理函数使用
+
+    与创建它的 Session 共享全部状态(event/driver/matched 等), 各Api方法均需 await 调用
+    '''
+    def __init__(self, session: Session) -> None:
+        self.__dict__ = session.__dict__
+
+    state = Session.state
+
+    async def call_action(self, action: str, params: dict, timeout: float = 30) -> dict:
+        '''
+        同 Session.call_action, 等待返回期间不会阻塞事件循环
+        '''
+        return await self.driver.call_action(action, params, timeout)
+
+    async def batch(self, calls: Iterable[Tuple[str, dict]], window: int = 16, timeout: float = 30) -> List[dict]:
+        '''
+        同 Session.batch
+        '''
+        return await batch_call(self.driver, calls, window, timeout)
+
+    async def send_group_msg(self, group_id: int, message) -> int:
+        '''
+        同 Session.send_group_msg
+        '''
+        params = {'group_id': group_id, "message": message}
+        ret = await self.call_action('send_group_msg', params)
+
+        return 0 if ret is None or ret["status"] == "failed" else ret["data"]["message_id"]
+
+    async def send_private_msg(self, user_id: int, message) -> int:
+        '''
+        同 Session.send_private_msg
+        '''
+        params = {'user_id': user_id, "message": message}
+        ret = await self.call_action('send_private_msg', params)
+
+        return 0 if ret is None or ret["status"] == "failed" else ret["data"]["message_id"]
+
+    async def send_msg(self, message) -> int:
+        '''
+        同 Session.send_msg
+        '''
+        _, group_id, user_id = self.event.key
+        if group_id:
+            return await self.send_group_msg(group_id, message)
+        else:
+            return await self.send_private_msg(user_id, message)
+
+    async def send_group_forward_msg(self, group_id: int, messages) -> None:
+        '''
+        同 Session.send_group_forward_msg
+        '''
+        await self.call_action(
+            'send_group_forward_msg',
+            {
+                'group_id': group_id,
+                'messages': messages
+            }
+        )
+
+    async def get_msg(self, message_id: int) -> dict:
+        '''
+        同 Session.get_msg
+        '''
+        return await self.call_action('get_msg', {'message_id': message_id})
+
+    async def delete_msg(self, message_id: int) -> None:
+        '''
+        同 Session.delete_msg
+        '''
+        await self.call_action('delete_msg', {'message_id': message_id})
+
+    async def set_group_kick(self, group_id: int, user_id: int, reject_add_request: bool = False) -> None:
+        '''
+        同 Session.set_group_kick
+        '''
+        await self.call_action(
+            'set_group_kick',
+            {
+                "group_id": group_id,
+                "user_id": user_id,
+                "reject_add_request": reject_add_request
+            }
+        )
+
+    async def set_group_ban(self, group_id: int, user_id: int, duration: int = 30*60) -> None:
+        '''
+        同 Session.set_group_ban
+        '''
+        await self.call_action(
+            'set_group_ban',
+            {
+                "group_id": group_id,
+                "user_id": user_id,
+                "duration": duration
+            }
+        )
+
+    async def set_group_whole_ban(self, group_id: int, enable: bool = True) -> None:
+        '''
+        同 Session.set_group_whole_ban
+        '''
+        await self.call_action(
+            'set_group_whole_ban',
+            {
+                'group_id': group_id,
+                "enable": enable
+            }
+        )
+
+    async def set_group_admin(self, group_id: int, user_id: int, enable: bool = True) -> None:
+        '''
+        同 Session.set_group_admin
+        '''
+        await self.call_action(
+            'set_group_admin',
+            {
+                "group_id": group_id,
+                "user_id": user_id,
+                "enable": enable
+            }
+        )
+
+    async def set_group_card(self, group_id: int, user_id: int, card: str = "") -> None:
+        '''
+        同 Session.set_group_card
+        '''
+        await self.call_action(
+            'set_group_card',
+            {
+                "group_id": group_id,
+                "user_id": user_id,
+                "card": card
+            }
+        )
+
+    async def get_group_info(self, group_id: int, no_cache: bool = False) -> dict:
+        '''
+        同 Session.get_group_info
+        '''
+        return await self.call_action(
+            'get_group_info',
+            {
+                'group_id': group_id, 'no_cache': no_cache
+            }
+        )
+
+    async def get_group_member_info(self, group_id: int, user_id: int, no_cache: bool = False) -> dict:
+        '''
+        同 Session.get_group_member_info
+        '''
+        return await self.call_action(
+            'get_group_member_info',
+            {
+                'group_id': group_id,
+                'user_id': user_id,
+                'no_cache': no_cache
+            }
+        )
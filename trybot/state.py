@@ -0,0 +1,279 @@
+"""
+此模块提供插件的持久化状态存储, 由 sqlite3(WAL 模式)保存, 写入先进入内存再由后台线程批量提交
+"""
+
+import json
+import time
+import atexit
+import sqlite3
+import threading
+from .logger import logger
+from collections import OrderedDict
+from typing import Any, Dict
+
+
+_MISSING = object()
+_DELETED = object()     # 已删除或不存在的键
+
+
+def _key(key) -> str:
+    if type(key) is str:
+        return key
+    if type(key) is int:
+        return str(key)
+    return json.dumps(key, ensure_ascii=False)
+
+
+class StateStore:
+    '''
+    持久化的键值存储, 值须可以 JSON 序列化
+
+    - 读取优先命中内存中的热缓存, 缓存项超过 max_size 时淘汰最久未使用且已提交的项
+
+    - 写入只更新内存, 由后台线程每隔 flush_interval 秒将期间的全部修改在一个事务内提交, 处理消息时不会等待磁盘同步
+
+    - 同一进程内的读写是线程安全的
+
+    - shared 为 True 时(多进程模式下由工作进程设置)数据库由多个进程共用: 读取绕过热缓存直接查询数据库(本进程尚未提交的修改除外),
+      incr 在一个写事务内读取并写回, 不同进程同时累加同一个键不会丢失; set 仍以最后提交的为准
+
+    以上参数的默认值为类属性, 需在首次使用 session.state 之前修改, 例如 StateStore.path = 'data/state.db'
+    '''
+    path: str = 'trybot_state.db'
+    flush_interval: float = 0.2
+    max_size: int = 100000
+    shared: bool = False
+
+    __default: 'StateStore' = None
+    __default_lock = threading.Lock()
+
+    def __init__(self, path: str = None) -> None:
+        self.path = path or self.path
+        self.flushed = 0    # 已提交的修改数
+
+        self.__lock = threading.RLock()
+        self.__flush_lock = threading.Lock()    # 写入连接同一时间只能进行一个事务
+        self.__cache: Dict[tuple, Any] = OrderedDict()
+        self.__dirty: Dict[tuple, Any] = {}         # 等待提交的修改
+        self.__flushing: Dict[tuple, Any] = {}      # 正在提交的修改
+        self.__namespaces: Dict[str, State] = {}
+
+        self.__reader = self.__connect()
+        self.__reader.execute(
+            'CREATE TABLE IF NOT EXISTS state ('
+            'namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, PRIMARY KEY (namespace, key))'
+        )
+        self.__writer = self.__connect()
+
+        self.__closed = False
+        self.__wakeup = threading.Event()
+        self.__thread = threading.Thread(target=self.__flusher, name='trybot-state', daemon=True)
+        self.__thread.start()
+        atexit.register(self.close)
+
+    def __connect(self) -> sqlite3.Connection:
+        db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('PRAGMA synchronous=NORMAL')
+        db.execute('PRAGMA busy_timeout=5000')
+        return db
+
+    @classmethod
+    def default(cls) -> 'StateStore':
+        '''
+        获取默认的存储, 首次调用时才打开数据库文件
+        '''
+        if cls.__default is None:
+            with cls.__default_lock:
+                if cls.__default is None:
+                    cls.__default = cls()
+        return cls.__default
+
+    def namespace(self, name: str) -> 'State':
+        state = self.__namespaces.get(name)
+        if state is None:
+            state = self.__namespaces[name] = State(self, name)
+        return state
+
+    def stats(self) -> dict:
+        return {'cached': len(self.__cache), 'dirty': len(self.__dirty), 'flushed': self.flushed}
+
+    def get(self, namespace: str, key, default=None):
+        item = (namespace, _key(key))
+        with self.__lock:
+            value = self.__cache.get(item, _MISSING)
+            if self.shared and item not in self.__dirty and item not in self.__flushing:
+                value = _MISSING    # 其它进程可能已修改, 缓存只用于保留本进程未提交的修改
+            if value is _MISSING:   # 未缓存, 读取数据库
+                row = self.__reader.execute(
+                    'SELECT value FROM state WHERE namespace = ? AND key = ?', item
+                ).fetchone()
+                value = json.loads(row[0]) if row else _DELETED
+                self.__cache[item] = value
+                self.__evict()
+            else:
+                self.__cache.move_to_end(item)
+        return default if value is _DELETED else value
+
+    def set(self, namespace: str, key, value) -> None:
+        if not isinstance(value, (str, int, float, type(None))):
+            json.dumps(value)   # 写入时即检查能否序列化, 以免在后台提交时才出错
+        self.__update((namespace, _key(key)), value)
+
+    def delete(self, namespace: str, key) -> None:
+        self.__update((namespace, _key(key)), _DELETED)
+
+    def incr(self, namespace: str, key, amount: float = 1) -> float:
+        '''
+        将数值加上 amount 并返回结果, 键不存在时视为 0
+        '''
+        if self.shared:
+            return self.__incr_shared((namespace, _key(key)), amount)
+
+        item = (namespace, _key(key))
+        with self.__lock:
+            value = self.get(namespace, key, 0) + amount
+            self.__cache[item] = self.__dirty[item] = value
+        self.__wakeup.set()
+        return value
+
+    def __incr_shared(self, item: tuple, amount: float) -> float:
+        # 先提交本进程的修改, 再在写事务内读取并写回, 期间其它进程无法写入
+        with self.__flush_lock:
+            self.__flush()
+            try:
+                self.__writer.execute('BEGIN IMMEDIATE')
+                row = self.__writer.execute(
+                    'SELECT value FROM state WHERE namespace = ? AND key = ?', item
+                ).fetchone()
+                value = (json.loads(row[0]) if row else 0) + amount
+                self.__writer.execute(
+                    'INSERT OR REPLACE INTO state (namespace, key, value) VALUES (?, ?, ?)', (*item, json.dumps(value))
+                )
+                self.__writer.execute('COMMIT')
+            except BaseException:
+                if self.__writer.in_transaction:
+                    self.__writer.execute('ROLLBACK')
+                raise
+        with self.__lock:
+            if item not in self.__dirty:    # 期间本进程又写入了该键时以新的修改为准
+                self.__cache[item] = value
+                self.__evict()
+        return value
+
+    def __update(self, item: tuple, value) -> None:
+        with self.__lock:
+            self.__cache[item] = self.__dirty[item] = value
+            self.__cache.move_to_end(item)
+            self.__evict()
+        self.__wakeup.set()
+
+    def __evict(self) -> None:
+        # 未提交的修改必须留在缓存中, 否则读取数据库会得到旧值
+        while len(self.__cache) > self.max_size:
+            for item in self.__cache:
+                if item not in self.__dirty and item not in self.__flushing:
+                    del self.__cache[item]
+                    break
+            else:
+                break
+
+    def flush(self) -> None:
+        '''
+        立即在一个事务内提交全部修改
+        '''
+        with self.__flush_lock:
+            self.__flush()
+
+    def __flush(self) -> None:
+        with self.__lock:
+            if not self.__dirty:
+                return
+            self.__flushing, self.__dirty = self.__dirty, {}
+            changes = self.__flushing
+
+        try:
+            self.__writer.execute('BEGIN')
+            self.__writer.executemany(
+                'INSERT OR REPLACE INTO state (namespace, key, value) VALUES (?, ?, ?)',
+                [(ns, key, json.dumps(value, ensure_ascii=False)) for (ns, key), value in changes.items() if value is not _DELETED]
+            )
+            self.__writer.executemany(
+                'DELETE FROM state WHERE namespace = ? AND key = ?',
+                [item for item, value in changes.items() if value is _DELETED]
+            )
+            self.__writer.execute('COMMIT')
+            self.flushed += len(changes)
+        except sqlite3.Error:
+            logger.exception('提交插件状态失败, 将在下次提交时重试')
+            if self.__writer.in_transaction:
+                self.__writer.execute('ROLLBACK')
+            with self.__lock:   # 期间的新修改优先
+                changes.update(self.__dirty)
+                self.__dirty = changes
+        finally:
+            with self.__lock:
+                self.__flushing = {}
+
+    def __flusher(self) -> None:
+        while not self.__closed:
+            self.__wakeup.wait()
+            self.__wakeup.clear()
+            time.sleep(self.flush_interval)     # 积攒这段时间内的修改
+            self.flush()
+
+    def close(self) -> None:
+        '''
+        提交剩余的修改并关闭数据库
+        '''
+        if self.__closed:
+            return
+        self.__closed = True
+        self.__wakeup.set()
+        self.__thread.join(self.flush_interval + 5)
+        self.flush()
+        self.__reader.close()
+        self.__writer.close()
+
+
+class State:
+    '''
+    某个插件的状态, 以处理函数的 模块名.限定名 为命名空间, 可以像 dict 一样读写
+
+    键可以是 str 或可以 JSON 序列化的值(如 (group_id, user_id)); 修改取出的 list/dict 后需重新赋值才会保存
+    '''
+    __slots__ = ('store', 'namespace')
+
+    def __init__(self, store: StateStore, namespace: str) -> None:
+        self.store = store
+        self.namespace = namespace
+
+    def get(self, key, default=None):
+        return self.store.get(self.namespace, key, default)
+
+    def set(self, key, value) -> None:
+        self.store.set(self.namespace, key, value)
+
+    def incr(self, key, amount: float = 1) -> float:
+        '''
+        将数值加上 amount 并返回结果, 键不存在时视为 0
+        '''
+        return self.store.incr(self.namespace, key, amount)
+
+    def __getitem__(self, key):
+        value = self.store.get(self.namespace, key, _DELETED)
+        if value is _DELETED:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value) -> None:
+        self.store.set(self.namespace, key, value)
+
+    def __delitem__(self, key) -> None:
+        self.store.delete(self.namespace, key)
+
+    def __contains__(self, key) -> bool:
+        return self.store.get(self.namespace, key, _DELETED) is not _DELETED
+
+
+__all__ = ['StateStore', 'State']
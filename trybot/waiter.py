@@ -0,0 +1,147 @@
+"""
+此模块提供会话等待的实现
+"""
+
+import heapq
+import asyncio
+import itertools
+from .logger import logger
+from typing import Collection, Generator, Tuple
+
+
+class Waiter(dict):
+    '''
+    会话等待表: (self_id, group_id, user_id) -> (generator, future, 发起等待的插件, 发起等待的 Session)
+
+    私聊的 group_id 为 0, 因此同一用户在不同群聊/私聊中的等待互不干扰
+
+    listen 收到等待中会话的消息时通过 resolve 立即唤醒, 超时统一由一个最小堆按截止时间清理
+
+    : param max_size: 同时等待的会话上限, 超出时提前结束最早到期的会话
+    '''
+    def __init__(self, max_size: int = 10000) -> None:
+        super().__init__()
+        self.max_size = max_size
+        self.expired = 0    # 超时(含被取代、被淘汰)的等待数
+        self.completed = 0  # 收到输入的等待数
+
+        self.__heap = []    # [(deadline, seq, key, future)], 已结束的等待在出堆时跳过
+        self.__seq = itertools.count()
+        self.__timer: asyncio.TimerHandle = None
+
+    @staticmethod
+    def key(event: dict, uid: int = None) -> Tuple[int, int, int]:
+        '''
+        获取事件所属会话的键
+        '''
+        return (
+            event.get('self_id', 0),
+            event.get('group_id', 0),
+            event.get('user_id', 0) if uid is None else uid
+        )
+
+    def stats(self) -> dict:
+        return {'active': len(self), 'expired': self.expired, 'completed': self.completed}
+
+    async def wait(self, key: tuple, ret: Generator, timeout: float = 30, owner: type = None, session=None) -> bool:
+        '''
+        等待会话输入, 超时或匹配规则处理输入失败时返回 True
+
+        : param owner: 发起等待的插件, 插件重新加载时据此找出旧版本的等待
+
+        : param session: 发起等待的 Session, 收到输入时将回复的消息事件保存至其 reply 属性
+        '''
+        if key in self:     # 同一会话的上一次等待被新的会话取代
+            self.__expire(key)
+        elif len(self) >= self.max_size:
+            self.__evict()
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self[key] = (ret, future, owner, session)
+
+        if len(self.__heap) > 2 * len(self) + 1024:     # 清理已结束的等待, 保持堆的大小有界
+            self.__heap = [item for item in self.__heap if not item[3].done()]
+            heapq.heapify(self.__heap)
+        heapq.heappush(self.__heap, (loop.time() + timeout, next(self.__seq), key, future))
+        self.__schedule(loop)
+
+        return await future
+
+    def resolve(self, key: tuple, event) -> None:
+        '''
+        将会话输入传递给等待中的会话: 匹配规则收到消息的纯文本 event.text, 消息事件本身保存至 session.reply
+
+        匹配规则处理输入时结束或抛出异常均只记录日志, 该等待按匹配失败结束
+        '''
+        ret, future, _, session = self.pop(key)
+        if session is not None:
+            session.reply = event
+        try:
+            ret.send(event.text)
+        except StopIteration:   # 规则在接收输入后未再给出结果, 视为匹配失败
+            logger.error(f'会话[{key}]的匹配规则在接收输入后提前结束')
+            failed = True
+        except Exception:       # 插件代码的异常不应影响接收事件
+            logger.exception(f'会话[{key}]的匹配规则处理输入异常')
+            failed = True
+        else:
+            self.completed += 1
+            failed = False
+        if not future.done():
+            future.set_result(failed)
+
+    def owned(self, owners: Collection[type]) -> list:
+        '''
+        获取由 owners 中的插件发起的等待的键
+        '''
+        return [key for key, (_, _, owner, _) in self.items() if owner in owners]
+
+    def expire(self, keys: list) -> int:
+        '''
+        提前结束仍在等待中的会话, 返回结束的数量
+        '''
+        count = 0
+        for key in keys:
+            if key in self:
+                self.__expire(key)
+                count += 1
+        return count
+
+    def __expire(self, key: tuple) -> None:
+        _, future, _, _ = self.pop(key)
+        self.expired += 1
+        if not future.done():
+            future.set_result(True)
+
+    def __evict(self) -> None:
+        while self.__heap:
+            _, _, key, future = heapq.heappop(self.__heap)
+            if not future.done():
+                logger.warning(f'等待会话数量已达上限{self.max_size}, 提前结束会话[{key}]')
+                self.__expire(key)
+                return
+
+    def __schedule(self, loop: asyncio.AbstractEventLoop) -> None:
+        # 始终只保留一个定时器, 指向堆顶最早到期的等待
+        if not self.__heap:
+            return
+        deadline = self.__heap[0][0]
+        if self.__timer is not None:
+            if self.__timer.when() <= deadline:
+                return
+            self.__timer.cancel()
+        self.__timer = loop.call_at(deadline, self.__sweep, loop)
+
+    def __sweep(self, loop: asyncio.AbstractEventLoop) -> None:
+        self.__timer = None
+        now = loop.time()
+        while self.__heap and self.__heap[0][0] <= now:
+            _, _, key, future = heapq.heappop(self.__heap)
+            if not future.done():
+                logger.error(f'等待会话输入[{key}] -> 超时......')
+                self.__expire(key)
+        self.__schedule(loop)
+
+
+__all__ = ['Waiter']
@@ -0,0 +1,170 @@
+"""
+此模块提供多进程模式: 由读取进程持有 WebSocket 连接, 事件按会话分发给多个工作进程处理
+"""
+
+import asyncio
+import importlib
+import itertools
+import threading
+import multiprocessing
+from .logger import logger
+from .waiter import Waiter
+from .event import Event, MessageEvent
+from .scheduler import Scheduler
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+
+class WorkerDriver:
+    '''
+    工作进程内代替 BotDriver 的驱动
+
+    API调用经由队列交给读取进程发送, 返回结果按调用编号分发给对应的 Future
+    '''
+    def __init__(self, wid: int, outbox: multiprocessing.Queue) -> None:
+        self.wid = wid
+        self.outbox = outbox
+        self.loop: asyncio.AbstractEventLoop = None
+        self.self_id: int = None
+
+        self.backer: Dict[int, asyncio.Future] = {}
+        self.waiter = Waiter()
+        self.__cid = itertools.count(1)
+
+    def in_loop(self) -> bool:
+        try:
+            return asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            return False
+
+    async def call_action(self, action: str, params: dict, timeout: float = 30) -> dict:
+        '''
+        同 BotDriver.call_action
+        '''
+        cid = next(self.__cid)
+        future = self.loop.create_future()
+        self.backer[cid] = future
+
+        self.outbox.put(('call', self.wid, cid, self.self_id, action, params, timeout))
+        try:    # 读取进程自身也会超时返回, 此处多等待1秒以便收到其结果
+            return await asyncio.wait_for(future, timeout + 1)
+        except asyncio.TimeoutError:
+            logger.error(f"接收API[{action}]返回 -> 超时......")
+        finally:
+            self.backer.pop(cid, None)
+
+    def resolve(self, cid: int, ret: dict) -> None:
+        future = self.backer.pop(cid, None)
+        if future and not future.done():
+            future.set_result(ret)
+
+
+async def _worker_serve(driver: WorkerDriver, inbox: multiprocessing.Queue, scheduler: Scheduler):
+    driver.loop = asyncio.get_running_loop()
+    while True:
+        kind, *args = await driver.loop.run_in_executor(None, inbox.get)
+        if kind == 'result':
+            driver.resolve(*args)
+            continue
+
+        event, = args
+        driver.self_id = event.get('self_id', driver.self_id)
+        if isinstance(event, MessageEvent) and event.key in driver.waiter:  # 会话等待, 规则收到纯文本, 回复事件保存至 session.reply
+            driver.waiter.resolve(event.key, event)
+        else:
+            await scheduler.put(event)
+
+
+def _worker_main(wid: int, inbox, outbox, plugins: List[str], plugin_dirs: List[str],
+                 workers: int, concurrency: int, queue_size: int, policy: str, reload_interval: float):
+    from . import Plugin, StateStore, event_handler
+    from .loader import load_plugins, watch_plugins
+
+    StateStore.shared = True    # 各工作进程共用同一个状态数据库
+
+    for name in plugins:
+        importlib.import_module(name)
+    for path in plugin_dirs:
+        load_plugins(path)
+    Plugin.executor = ThreadPoolExecutor(workers, thread_name_prefix=f'trybot-{wid}')
+
+    driver = WorkerDriver(wid, outbox)
+
+    async def serve():
+        scheduler = Scheduler(lambda event: event_handler(event, driver), concurrency, queue_size, policy)
+        tasks = [_worker_serve(driver, inbox, scheduler)]
+        if reload_interval > 0:     # 各工作进程分别检查并重新加载插件
+            tasks.append(watch_plugins([driver], reload_interval))
+        await asyncio.gather(*tasks)
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+class WorkerPool:
+    '''
+    工作进程池, 在 listen 中代替 Scheduler 接收事件
+
+    同一会话(见 Event.key)的事件总是分发给同一个工作进程, 从而保持会话内的顺序与会话等待
+
+    : param manager: 发送API调用所使用的连接管理器
+
+    : param processes: 工作进程数
+
+    : param plugins: 工作进程启动时需要导入的插件模块名(spawn 方式启动时需要, fork 时已继承)
+
+    : param plugin_dirs: 工作进程启动时需要加载的插件目录或插件包(见 load_plugins)
+
+    : param reload_interval: 大于0时各工作进程每隔该秒数检查插件目录并重新加载变化的模块(见 watch_plugins)
+
+    其余参数为各工作进程内的线程池与调度器参数
+    '''
+    def __init__(self, manager, processes: int, plugins: List[str] = None, workers: int = 16,
+                 concurrency: int = 64, queue_size: int = 100, policy: str = 'drop', plugin_dirs: List[str] = None,
+                 reload_interval: float = 0) -> None:
+        self.manager = manager
+        self.outbox = multiprocessing.Queue()
+        self.inboxes = [multiprocessing.Queue() for _ in range(processes)]
+        self.processes = [
+            multiprocessing.Process(
+                target=_worker_main,
+                args=(wid, inbox, self.outbox, plugins or [], plugin_dirs or [], workers, concurrency, queue_size, policy, reload_interval),
+                name=f'trybot-worker-{wid}',
+                daemon=True
+            )
+            for wid, inbox in enumerate(self.inboxes)
+        ]
+
+    def start(self, loop: asyncio.AbstractEventLoop) -> None:
+        self.loop = loop
+        for process in self.processes:
+            process.start()
+        threading.Thread(target=self.__receive, name='trybot-worker-outbox', daemon=True).start()
+        logger.info(f'已启动{len(self.processes)}个工作进程')
+
+    async def put(self, event: Event) -> None:
+        '''
+        将事件按会话分发给工作进程
+        '''
+        inbox = self.inboxes[hash(event.key) % len(self.inboxes)]
+        inbox.put(('event', event))
+
+    def __receive(self) -> None:
+        while True:
+            _, *args = self.outbox.get()
+            asyncio.run_coroutine_threadsafe(self.__call(*args), self.loop)
+
+    async def __call(self, wid: int, cid: int, self_id: int, action: str, params: dict, timeout: float):
+        ret = None
+        try:
+            driver = self.manager.route({'self_id': self_id})
+            ret = await driver.call_action(action, params, timeout)
+        except Exception:
+            logger.exception(f'工作进程{wid}的API[{action}]调用异常')
+        finally:    # 无论成功与否都须返回结果, 否则工作进程会一直等待至超时
+            self.inboxes[wid].put(('result', cid, ret))
+
+
+__all__ = ['WorkerDriver', 'WorkerPool']